@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+
+class TTLCache:
+    """Small in-process cache whose entries expire after a fixed time.
+
+    Concurrent loads of the same missing key share a single load, and a
+    load that returns None is not cached. Values built some other way can
+    be stored with reserve() and put().
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = {}
+        self.loading = {}
+        self.building = {}
+
+    def peek(self, key):
+        """Return the cached value for key, or None if there is none"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at > time.monotonic():
+            return value
+        del self.entries[key]
+        return None
+
+    async def get(self, key, load):
+        """Return the cached value for key, calling load() on a miss"""
+        value = self.peek(key)
+        if value is not None:
+            return value
+
+        task = self.loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self.loading[key] = task
+            task.add_done_callback(lambda done: self._store(key, done))
+
+        # Shield the shared load so one cancelled caller does not cancel it
+        # for everyone else waiting on the same key
+        return await asyncio.shield(task)
+
+    def reserve(self, key):
+        """Start building a value for key, returning a token for put()"""
+        token = object()
+        self.building[key] = token
+        return token
+
+    def put(self, key, token, value):
+        """Cache value for key unless it was invalidated since reserve()"""
+        if self.building.get(key) is not token:
+            return
+        del self.building[key]
+        self._set(key, value)
+
+    def discard(self, key, token):
+        """Give up a reserve() for key without caching anything"""
+        if self.building.get(key) is token:
+            del self.building[key]
+
+    def invalidate(self, key):
+        """Drop key and detach any load that is still in flight for it"""
+        self.entries.pop(key, None)
+        self.loading.pop(key, None)
+        self.building.pop(key, None)
+
+    def _store(self, key, task):
+        # A load started before invalidate() must not repopulate the cache
+        if self.loading.get(key) is not task:
+            return
+        del self.loading[key]
+
+        if task.cancelled() or task.exception() is not None:
+            return
+        value = task.result()
+        if value is None:
+            return
+        self._set(key, value)
+
+    def _set(self, key, value):
+        if key not in self.entries and len(self.entries) >= self.maxsize:
+            # Entries are kept in insertion order, so this is the oldest
+            del self.entries[next(iter(self.entries))]
+        self.entries[key] = (time.monotonic() + self.ttl, value)
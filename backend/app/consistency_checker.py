@@ -1,47 +1,172 @@
 import asyncio
-import uuid
-from datetime import datetime, timedelta
-from db.cassandra import execute_async
+from collections import defaultdict
+from datetime import datetime, timezone
+from db.cassandra import (  # type: ignore
+    execute_async,
+    execute_paged,
+    get_prepared,
+    resume_pages
+)
 import logging
-from cassandra.query import SimpleStatement
+from cassandra import ConsistencyLevel
+from cassandra.query import BatchStatement, BatchType
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of statements sent in a single repair batch
+BATCH_SIZE = 50
+# Page size used when scanning whole tables
+SCAN_FETCH_SIZE = 1000
+# Full-table scans, reading just the columns the checks need
+SCAN_ACTIVE_RESERVATIONS = (
+    "SELECT user_id, book_id, reservation_id, reservation_date "
+    "FROM reservations_user_book"
+)
+SCAN_RESERVATIONS = "SELECT reservation_id, status FROM reservations"
+SCAN_BOOKS = "SELECT book_id, title, status, created_at FROM books"
+SCAN_BY_USER = (
+    "SELECT user_id, reservation_id, status FROM reservations_by_user"
+)
+SCAN_BY_BOOK = (
+    "SELECT book_id, reservation_id, status FROM reservations_by_book"
+)
+SCAN_BOOKS_BY_STATUS = "SELECT status, book_id, title FROM books_by_status"
+SCAN_USER_COUNTERS = "SELECT user_id, active_count FROM user_counters"
+# Maximum number of independent repair queries kept in flight at once
+GATHER_CHUNK_SIZE = 200
+
+UPDATE_BOOK_STATUS = "UPDATE books SET status = ? WHERE book_id = ?"
+UPDATE_RESERVATION_STATUS = (
+    "UPDATE reservations SET status = ?, updated_at = ? "
+    "WHERE reservation_id = ?"
+)
+UPDATE_BY_USER_STATUS = (
+    "UPDATE reservations_by_user SET status = ? "
+    "WHERE user_id = ? AND reservation_id = ?"
+)
+UPDATE_BY_BOOK_STATUS = (
+    "UPDATE reservations_by_book SET status = ? "
+    "WHERE book_id = ? AND reservation_id = ?"
+)
+# Conditional like every other write to reservations_user_book, whose rows
+# are claimed with a lightweight transaction
+DELETE_ACTIVE = (
+    "DELETE FROM reservations_user_book "
+    "WHERE user_id = ? AND book_id = ? IF EXISTS"
+)
+INSERT_BOOK_BY_STATUS = (
+    "INSERT INTO books_by_status (status, book_id, title, created_at) "
+    "VALUES (?, ?, ?, ?)"
+)
+DELETE_BOOK_BY_STATUS = (
+    "DELETE FROM books_by_status WHERE status = ? AND book_id = ?"
+)
+ADJUST_ACTIVE_COUNT = (
+    "UPDATE user_counters SET active_count = active_count + ? "
+    "WHERE user_id = ?"
+)
+
+# Every statement above, prepared once at startup
+STATEMENTS = (
+    SCAN_ACTIVE_RESERVATIONS,
+    SCAN_RESERVATIONS,
+    SCAN_BOOKS,
+    SCAN_BY_USER,
+    SCAN_BY_BOOK,
+    SCAN_BOOKS_BY_STATUS,
+    SCAN_USER_COUNTERS,
+    UPDATE_BOOK_STATUS,
+    UPDATE_RESERVATION_STATUS,
+    UPDATE_BY_USER_STATUS,
+    UPDATE_BY_BOOK_STATUS,
+    DELETE_ACTIVE,
+    INSERT_BOOK_BY_STATUS,
+    DELETE_BOOK_BY_STATUS,
+    ADJUST_ACTIVE_COUNT,
+)
+
 
 class DataConsistencyChecker:
-    def __init__(self, check_interval_seconds=10, quiet_period_seconds=15):
-        self.check_interval = check_interval_seconds
+    def __init__(self, quiet_period_seconds=15):
         # How long to wait after last write before checking
         self.quiet_period = quiet_period_seconds
-        self.last_write_time = datetime.utcnow()
-        self.last_check_time = datetime.utcnow()
         self.is_running = False
         self.task = None
+        # Single timer that fires once writes have settled, and the loop
+        # time of the most recent write
+        self._pending_check = None
+        self._last_write = 0.0
+        # Fingerprint of the last state a check found nothing to fix in
+        self._last_state_hash = None
 
     def mark_write_activity(self):
         """Call this method whenever a write operation occurs"""
-        self.last_write_time = datetime.utcnow()
+        if not self.is_running:
+            return
+
+        # Only record the time here; the pending timer pushes itself back
+        # when it fires, so a burst of writes never cancels and recreates
+        # timers
+        loop = asyncio.get_running_loop()
+        self._last_write = loop.time()
+        if self._pending_check is None:
+            self._pending_check = loop.call_later(
+                self.quiet_period, self._trigger_check
+            )
+
+    def _trigger_check(self):
+        """Run a check once the quiet period after the last write elapsed"""
+        loop = asyncio.get_running_loop()
+        remaining = self._last_write + self.quiet_period - loop.time()
+        if remaining > 0:
+            # Writes arrived since this timer was set, wait for the rest
+            self._pending_check = loop.call_later(
+                remaining, self._trigger_check
+            )
+            return
+
+        self._pending_check = None
+
+        if self.task is not None and not self.task.done():
+            # Previous check still running, look again after another
+            # quiet period
+            self._pending_check = loop.call_later(
+                self.quiet_period, self._trigger_check
+            )
+            return
+
+        logger.info(
+            "Write activity detected and quiet period elapsed "
+            "(%ss), running consistency check...", self.quiet_period
+        )
+        self.task = asyncio.create_task(self.run_consistency_check())
 
     async def start_monitoring(self):
-        """Start the consistency checker task"""
+        """Start the consistency checker"""
         if self.is_running:
             logger.warning("Consistency checker is already running")
             return
 
         self.is_running = True
-        self.task = asyncio.create_task(self._monitor_loop())
         logger.info(
-            "Data consistency checker started "
-            f"(interval: {self.check_interval}s, "
-            f"quiet period: {self.quiet_period}s)"
+            "Data consistency checker started (quiet period: %ss)",
+            self.quiet_period
         )
 
+        # Check once after startup as well, so that anything written while
+        # the server was down, or a newly added table such as
+        # books_by_status, is reconciled without waiting for a write
+        self.mark_write_activity()
+
     async def stop_monitoring(self):
-        """Stop the consistency checker task"""
+        """Stop the consistency checker and any check in progress"""
         if not self.is_running:
             return
 
         self.is_running = False
+        if self._pending_check is not None:
+            self._pending_check.cancel()
+            self._pending_check = None
         if self.task:
             self.task.cancel()
             try:
@@ -50,435 +175,586 @@ class DataConsistencyChecker:
                 pass
         logger.info("Data consistency checker stopped")
 
-    async def _monitor_loop(self):
-        """Main monitoring loop"""
-        try:
-            while self.is_running:
-                await asyncio.sleep(self.check_interval)
-
-                now = datetime.utcnow()
-
-                # Check if there was write activity since last check
-                write_activity_since_last_check = (
-                    self.last_write_time > self.last_check_time
-                )
-
-                # Check if enough time has passed
-                # since last write (quiet period)
-                time_since_last_write = now - self.last_write_time
-                quiet_period_elapsed = (
-                    time_since_last_write >= timedelta(
-                        seconds=self.quiet_period
-                    )
-                )
-
-                if write_activity_since_last_check and quiet_period_elapsed:
-                    logger.info(
-                        "Write activity detected since last check "
-                        "and quiet period elapsed "
-                        f"({time_since_last_write.total_seconds():.1f}s), "
-                        "running consistency check..."
-                    )
-                    await self.run_consistency_check()
-                    self.last_check_time = now
-                elif write_activity_since_last_check:
-                    t = (
-                        self.quiet_period
-                        - time_since_last_write.total_seconds()
-                    )
-                    logger.debug(
-                        "Write activity detected but still in quiet period "
-                        f"(waiting {t:.1f}s more"
-                    )
-
-        except asyncio.CancelledError:
-            logger.info("Consistency checker task cancelled")
-        except Exception as e:
-            logger.error(f"Error in consistency checker loop: {e}")
-
     async def run_consistency_check(self):
         """Main consistency check function"""
         try:
             logger.info("Starting data consistency check...")
 
+            # Single timestamp used for every repair made during this run
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+
             # Load all data into memory first to avoid inefficient queries
             data = await self._load_all_data()
 
+            if (
+                data['active_count'] == 0
+                and data['reservation_count'] == 0
+                and not data['book_status_fixes']
+                and not data['book_listing_fixes']
+                and not data['stray_book_listings']
+                and not data['active_count_fixes']
+                and not data['by_user_status_fixes']
+                and not data['by_book_status_fixes']
+            ):
+                logger.info("Consistency check skipped. No reservations.")
+                return
+
+            # A state that a previous run already found consistent cannot
+            # need any repairs, so skip the remaining steps
+            state_hash = self._state_hash(data)
+            if state_hash == self._last_state_hash:
+                logger.info(
+                    "Consistency check skipped. "
+                    "State unchanged since last clean check."
+                )
+                return
+
             # Step 1: Fix duplicate reservations in reservations_user_book
             duplicates_fixed = await self._fix_duplicate_active_reservations(
-                data
+                data, now
             )
 
             # Step 2: Sync book statuses with active reservations
             book_status_fixes = await self._sync_book_statuses(data)
 
-            # Step 3: Sync reservation statuses across all tables
+            # Step 3: Sync books_by_status with the book statuses
+            book_listing_fixes = await self._sync_book_listings(data)
+
+            # Step 4: Sync reservation statuses across all tables
             reservation_status_fixes = await self._sync_reservation_statuses(
-                data
+                data, now
             )
 
-            # Step 4: Final validation
+            # Step 5: Sync user_counters with the active reservations
+            active_count_fixes = await self._sync_active_counts(data)
+
+            # Step 6: Final validation
             await self._validate_final_state(data)
 
             if (
                 duplicates_fixed > 0
                 or book_status_fixes > 0
+                or book_listing_fixes > 0
                 or reservation_status_fixes > 0
+                or active_count_fixes > 0
             ):
                 logger.warning(
-                    f"Consistency check completed. Fixed: "
-                    f"{duplicates_fixed} duplicates, "
-                    f"{book_status_fixes} book statuses, "
-                    f"{reservation_status_fixes} reservation statuses"
+                    "Consistency check completed. Fixed: %d duplicates, "
+                    "%d book statuses, %d book listings, "
+                    "%d reservation statuses, %d active counts",
+                    duplicates_fixed, book_status_fixes, book_listing_fixes,
+                    reservation_status_fixes, active_count_fixes
                 )
             else:
                 logger.info("Consistency check completed. No issues found.")
+                self._last_state_hash = state_hash
 
         except Exception as e:
-            logger.error(f"Error during consistency check: {e}")
+            logger.error("Error during consistency check: %s", e)
+
+    def _state_hash(self, data):
+        """Fingerprint the reservation and book state seen by a check"""
+        return hash((
+            frozenset(data['active_reservation_ids']),
+            frozenset(data['active_status_ids']),
+            data['checked_out_count'],
+            len(data['book_status_fixes']),
+            len(data['book_listing_fixes']),
+            len(data['stray_book_listings']),
+            len(data['active_count_fixes']),
+            # Rows of the denormalized tables are only fingerprinted by
+            # their mismatches, which every state a clean run saw lacked
+            frozenset(data['by_user_status_fixes']),
+            frozenset(data['by_book_status_fixes'])
+        ))
 
     async def _load_all_data(self):
         """Load all relevant data into memory to avoid inefficient queries"""
         try:
             logger.debug("Loading all data into memory...")
 
-            # Load all tables with simple SELECT * queries (no filtering)
-            active_reservations = await execute_async(
-                SimpleStatement(
-                    "SELECT * FROM reservations_user_book",
-                    fetch_size=100
-                )
-            )
-            all_reservations = await execute_async(
-                "SELECT * FROM reservations"
+            # Scan all tables for just the columns the checks read (no
+            # filtering). The scans are independent, so their first pages
+            # are read concurrently. Pages are awaited as they are consumed
+            # by the check that needs them, so rows are never copied into
+            # intermediate lists and the event loop is never blocked on a
+            # page fetch
+            (
+                active_reservations,
+                all_reservations,
+                all_books,
+                reservations_by_user,
+                reservations_by_book,
+                books_by_status,
+                user_counters
+            ) = await asyncio.gather(
+                self._scan(SCAN_ACTIVE_RESERVATIONS),
+                self._scan(SCAN_RESERVATIONS),
+                self._scan(SCAN_BOOKS),
+                self._scan(SCAN_BY_USER),
+                self._scan(SCAN_BY_BOOK),
+                self._scan(SCAN_BOOKS_BY_STATUS),
+                self._scan(SCAN_USER_COUNTERS)
             )
-            all_books = await execute_async("SELECT * FROM books")
-            reservations_by_user = await execute_async(
-                "SELECT * FROM reservations_by_user"
+
+            # Active reservations are needed by every step, so build all
+            # of their indices in a single pass. Each book maps to
+            # (reservation_date, reservation_id, user_id) tuples
+            book_reservations = defaultdict(list)
+            active_reservation_ids = set()
+            duplicate_book_ids = []
+            user_active_counts = defaultdict(int)
+            async for rows, _ in active_reservations:
+                for row in rows:
+                    reservations = book_reservations[row.book_id]
+                    reservations.append(
+                        (row.reservation_date, row.reservation_id, row.user_id)
+                    )
+                    if len(reservations) == 2:
+                        duplicate_book_ids.append(row.book_id)
+                    active_reservation_ids.add(row.reservation_id)
+                    user_active_counts[row.user_id] += 1
+
+            # How far each user's counter is below their number of active
+            # reservations, for every user whose counter is off
+            async for rows, _ in user_counters:
+                for row in rows:
+                    user_active_counts[row.user_id] -= row.active_count
+            active_count_fixes = {
+                user_id: delta
+                for user_id, delta in user_active_counts.items() if delta
+            }
+
+            # Listings keyed by (status, book_id). The books pass below
+            # removes each listing it expects, leaving only stray ones
+            listed_titles = {}
+            async for rows, _ in books_by_status:
+                for row in rows:
+                    listed_titles[(row.status, row.book_id)] = row.title
+
+            # Books are read by the status and listing syncs and by the
+            # final validation, so collect what each needs in one pass
+            book_status_fixes = []
+            book_listing_fixes = []
+            checked_out_count = 0
+            async for rows, _ in all_books:
+                for book in rows:
+                    if book.status == 'checked_out':
+                        checked_out_count += 1
+                    expected_status = (
+                        'checked_out' if book.book_id in book_reservations
+                        else 'available'
+                    )
+                    if book.status != expected_status:
+                        book_status_fixes.append(
+                            (book.book_id, book.title, book.status,
+                             expected_status)
+                        )
+                    # Listed under the status the book ends up with
+                    listing = (expected_status, book.book_id)
+                    if listed_titles.pop(listing, None) != book.title:
+                        book_listing_fixes.append(
+                            (expected_status, book.book_id, book.title,
+                             book.created_at)
+                        )
+            stray_book_listings = list(listed_titles)
+
+            # Same for the main reservations table, whose statuses are
+            # needed to fingerprint the state before any repair is made
+            active_status_ids = set()
+            reservation_status_fixes = []
+            reservation_count = 0
+            async for rows, _ in all_reservations:
+                for reservation in rows:
+                    reservation_count += 1
+                    is_active = (
+                        reservation.reservation_id in active_reservation_ids
+                    )
+                    if reservation.status == 'active':
+                        active_status_ids.add(reservation.reservation_id)
+                        if not is_active:
+                            reservation_status_fixes.append(
+                                (reservation.reservation_id, reservation.status,
+                                 'completed')
+                            )
+                    elif is_active:
+                        reservation_status_fixes.append(
+                            (reservation.reservation_id, reservation.status,
+                             'active')
+                        )
+
+            # The denormalized tables are checked row by row against the
+            # active reservations, so a status left stale by a failed write
+            # is found even when the main table is consistent
+            by_user_status_fixes = await self._denormalized_status_fixes(
+                reservations_by_user, 'user_id', active_reservation_ids
             )
-            reservations_by_book = await execute_async(
-                "SELECT * FROM reservations_by_book"
+            by_book_status_fixes = await self._denormalized_status_fixes(
+                reservations_by_book, 'book_id', active_reservation_ids
             )
 
             return {
-                'active_reservations': (
-                    list(active_reservations) if active_reservations else []
-                ),
-                'all_reservations': (
-                    list(all_reservations) if all_reservations else []
-                ),
-                'all_books': (
-                    list(all_books) if all_books else []
-                ),
-                'reservations_by_user': (
-                    list(reservations_by_user) if reservations_by_user else []
-                ),
-                'reservations_by_book': (
-                    list(reservations_by_book) if reservations_by_book else []
-                )
+                'book_reservations': book_reservations,
+                'duplicate_book_ids': duplicate_book_ids,
+                'active_reservation_ids': active_reservation_ids,
+                'active_count': len(active_reservation_ids),
+                'book_status_fixes': book_status_fixes,
+                'book_listing_fixes': book_listing_fixes,
+                'stray_book_listings': stray_book_listings,
+                'checked_out_count': checked_out_count,
+                'active_status_ids': active_status_ids,
+                'reservation_status_fixes': reservation_status_fixes,
+                'reservation_count': reservation_count,
+                'by_user_status_fixes': by_user_status_fixes,
+                'by_book_status_fixes': by_book_status_fixes,
+                'active_count_fixes': active_count_fixes
             }
 
         except Exception as e:
-            logger.error(f"Error loading data: {e}")
+            logger.error("Error loading data: %s", e)
             return {
-                'active_reservations': [],
-                'all_reservations': [],
-                'all_books': [],
-                'reservations_by_user': [],
-                'reservations_by_book': []
+                'book_reservations': defaultdict(list),
+                'duplicate_book_ids': [],
+                'active_reservation_ids': set(),
+                'active_count': 0,
+                'book_status_fixes': [],
+                'book_listing_fixes': [],
+                'stray_book_listings': [],
+                'checked_out_count': 0,
+                'active_status_ids': set(),
+                'reservation_status_fixes': [],
+                'reservation_count': 0,
+                'by_user_status_fixes': [],
+                'by_book_status_fixes': [],
+                'active_count_fixes': {}
             }
 
-    async def _fix_duplicate_active_reservations(self, data):
+    async def _denormalized_status_fixes(
+        self, pages, key_column, active_reservation_ids
+    ):
+        """Find rows of a by_user or by_book scan with the wrong status
+
+        Returns (partition key, reservation_id, current status, new status)
+        for every row whose status disagrees with active_reservation_ids.
+        """
+        fixes = []
+        async for rows, _ in pages:
+            for row in rows:
+                is_active = row.reservation_id in active_reservation_ids
+                if is_active and row.status != 'active':
+                    new_status = 'active'
+                elif not is_active and row.status == 'active':
+                    new_status = 'completed'
+                else:
+                    continue
+                fixes.append((
+                    getattr(row, key_column), row.reservation_id,
+                    row.status, new_status
+                ))
+        return fixes
+
+    async def _scan(self, query):
+        """Start a paged full-table scan, reading its first page"""
+        pages = execute_paged(get_prepared(query), fetch_size=SCAN_FETCH_SIZE)
+        return resume_pages(await anext(pages), pages)
+
+    async def _fix_duplicate_active_reservations(self, data, now):
         """Fix cases where a book is reserved by multiple users"""
         fixed_count = 0
 
         try:
-            active_reservations = data['active_reservations']
-
-            # Group by book_id to find duplicates
-            book_reservations = {}
-            for row in active_reservations:
-                book_id = str(row.book_id)
-                if book_id not in book_reservations:
-                    book_reservations[book_id] = []
-                book_reservations[book_id].append({
-                    'user_id': row.user_id,
-                    'reservation_id': row.reservation_id,
-                    'reservation_date': row.reservation_date
-                })
-
-            # Find books with multiple active reservations
-            for book_id, reservations in book_reservations.items():
-                if len(reservations) > 1:
-                    logger.warning(
-                        f"Found {len(reservations)} active "
-                        f"reservations for book {book_id}"
-                    )
+            # Active reservations grouped by book_id
+            book_reservations = data['book_reservations']
 
-                    # Keep the earliest reservation, cancel others
-                    reservations.sort(key=lambda x: x['reservation_date'])
-                    keep_reservation = reservations[0]
-                    cancel_reservations = reservations[1:]
+            # Books with multiple active reservations, found while grouping
+            cancellations = []
+            for book_id in data['duplicate_book_ids']:
+                reservations = book_reservations[book_id]
+                logger.warning(
+                    "Found %d active reservations for book %s",
+                    len(reservations), book_id
+                )
 
-                    logger.info(
-                        "Keeping reservation "
-                        f"{keep_reservation['reservation_id']}, "
-                        f"cancelling {len(cancel_reservations)} others"
-                    )
+                # Keep the earliest reservation, cancel others
+                keep_reservation = min(reservations, key=lambda r: r[0])
+                cancel_reservations = [
+                    r for r in reservations if r is not keep_reservation
+                ]
 
-                    # Cancel the duplicate reservations
-                    for reservation in cancel_reservations:
-                        await self._cancel_reservation(
-                            reservation['reservation_id'],
-                            reservation['user_id'],
-                            uuid.UUID(book_id)
-                        )
-                        fixed_count += 1
+                logger.info(
+                    "Keeping reservation %s, cancelling %d others",
+                    keep_reservation[1], len(cancel_reservations)
+                )
+
+                # Cancel the duplicate reservations
+                for _, reservation_id, user_id in cancel_reservations:
+                    cancellations.append(self._cancel_reservation(
+                        reservation_id, user_id, book_id, now
+                    ))
+                    fixed_count += 1
+
+            # A cancelled reservation no longer counts towards its user, so
+            # the counter sync later in this run must expect one fewer
+            active_count_fixes = data['active_count_fixes']
+            for user_id in await self._gather_in_chunks(cancellations):
+                if user_id is not None:
+                    active_count_fixes[user_id] = (
+                        active_count_fixes.get(user_id, 0) - 1
+                    )
 
             return fixed_count
 
         except Exception as e:
-            logger.error(f"Error fixing duplicate reservations: {e}")
+            logger.error("Error fixing duplicate reservations: %s", e)
             return 0
 
-    async def _cancel_reservation(self, reservation_id, user_id, book_id):
-        """Cancel a specific reservation and update all tables"""
+    async def _cancel_reservation(
+        self, reservation_id, user_id, book_id, now
+    ):
+        """Cancel a reservation in all tables, returning its user_id if done
+
+        The user's active_count is left to _sync_active_counts, as counter
+        updates cannot share a batch with the other writes.
+        """
         try:
-            now = datetime.utcnow()
+            # The three status updates belong to one logical cancellation,
+            # so apply them atomically in a single round trip
+            batch = BatchStatement(
+                batch_type=BatchType.LOGGED,
+                consistency_level=ConsistencyLevel.QUORUM
+            )
 
             # Update main reservations table
-            update_main = """
-                UPDATE reservations
-                SET status = 'completed', updated_at = %s
-                WHERE reservation_id = %s
-            """
-            await execute_async(update_main, (now, reservation_id))
+            batch.add(
+                get_prepared(UPDATE_RESERVATION_STATUS),
+                ('completed', now, reservation_id)
+            )
 
             # Update reservations_by_user table
-            update_by_user = """
-                UPDATE reservations_by_user
-                SET status = 'completed'
-                WHERE user_id = %s AND reservation_id = %s
-            """
-            await execute_async(update_by_user, (user_id, reservation_id))
+            batch.add(
+                get_prepared(UPDATE_BY_USER_STATUS),
+                ('completed', user_id, reservation_id)
+            )
 
             # Update reservations_by_book table
-            update_by_book = """
-                UPDATE reservations_by_book
-                SET status = 'completed'
-                WHERE book_id = %s AND reservation_id = %s
-            """
-            await execute_async(update_by_book, (book_id, reservation_id))
-
-            # Remove from active reservations table
-            delete_active = """
-                DELETE FROM reservations_user_book
-                WHERE user_id = %s AND book_id = %s
-            """
-            await execute_async(delete_active, (user_id, book_id))
-
-            logger.info(f"Cancelled duplicate reservation {reservation_id}")
+            batch.add(
+                get_prepared(UPDATE_BY_BOOK_STATUS),
+                ('completed', book_id, reservation_id)
+            )
+
+            await execute_async(batch)
+
+            # Remove from active reservations table. The delete is
+            # conditional, and a conditional batch must stay within one
+            # partition, so it is sent on its own
+            result = await execute_async(
+                get_prepared(DELETE_ACTIVE), (user_id, book_id)
+            )
+
+            logger.info("Cancelled duplicate reservation %s", reservation_id)
+            # A handler that removed the row first has already counted the
+            # reservation off its user
+            return user_id if result.was_applied else None
 
         except Exception as e:
-            logger.error(f"Error cancelling reservation {reservation_id}: {e}")
+            logger.error(
+                "Error cancelling reservation %s: %s", reservation_id, e
+            )
+            return None
 
     async def _sync_book_statuses(self, data):
         """Ensure book statuses match active reservations"""
         fixed_count = 0
 
         try:
-            all_books = data['all_books']
-            active_reservations = data['active_reservations']
-
-            # Create set of active book IDs for O(1) lookup
-            active_book_ids = {str(row.book_id) for row in active_reservations}
-
-            for book in all_books:
-                book_id_str = str(book.book_id)
-                current_status = book.status
-                should_be_checked_out = book_id_str in active_book_ids
-
-                # Fix status if inconsistent
-                if should_be_checked_out and current_status != 'checked_out':
-                    logger.warning(
-                        f"Book {book_id_str} ({book.title}) should "
-                        f"be checked_out but is '{current_status}'"
-                    )
-                    update_query = (
-                        "UPDATE books SET status = 'checked_out' "
-                        "WHERE book_id = %s"
-                    )
-                    await execute_async(update_query, (book.book_id,))
-                    fixed_count += 1
+            update_query = get_prepared(UPDATE_BOOK_STATUS)
 
-                elif (
-                    not should_be_checked_out
-                    and current_status != 'available'
-                ):
-                    logger.warning(
-                        f"Book {book_id_str} ({book.title}) should "
-                        f"be available but is '{current_status}'"
-                    )
-                    update_query = (
-                        "UPDATE books SET status = 'available' "
-                        "WHERE book_id = %s"
-                    )
-                    await execute_async(update_query, (book.book_id,))
-                    fixed_count += 1
+            # Mismatches were found while loading the books table
+            updates = []
+            for book_id, title, current_status, new_status in data[
+                'book_status_fixes'
+            ]:
+                logger.warning(
+                    "Book %s (%s) should be %s but is '%s'",
+                    book_id, title, new_status, current_status
+                )
+                updates.append(
+                    execute_async(update_query, (new_status, book_id))
+                )
+                fixed_count += 1
+
+            await self._gather_in_chunks(updates)
 
             return fixed_count
 
         except Exception as e:
-            logger.error(f"Error syncing book statuses: {e}")
+            logger.error("Error syncing book statuses: %s", e)
             return 0
 
-    async def _sync_reservation_statuses(self, data):
+    async def _sync_book_listings(self, data):
+        """Ensure books_by_status lists every book under its status"""
+        fixed_count = 0
+
+        try:
+            insert_listing = get_prepared(INSERT_BOOK_BY_STATUS)
+            delete_listing = get_prepared(DELETE_BOOK_BY_STATUS)
+
+            # Missing or outdated listings and leftovers under another
+            # status were both found while loading the books table
+            writes = []
+            for status, book_id, title, created_at in data[
+                'book_listing_fixes'
+            ]:
+                writes.append(execute_async(
+                    insert_listing, (status, book_id, title, created_at)
+                ))
+                fixed_count += 1
+
+            for status, book_id in data['stray_book_listings']:
+                logger.warning(
+                    "Book %s is wrongly listed as '%s'", book_id, status
+                )
+                writes.append(
+                    execute_async(delete_listing, (status, book_id))
+                )
+                fixed_count += 1
+
+            await self._gather_in_chunks(writes)
+
+            return fixed_count
+
+        except Exception as e:
+            logger.error("Error syncing book listings: %s", e)
+            return 0
+
+    async def _sync_reservation_statuses(self, data, now):
         """Ensure reservation statuses are consistent across all tables"""
         fixed_count = 0
 
         try:
-            active_reservations = data['active_reservations']
-            all_reservations = data['all_reservations']
-            reservations_by_user = data['reservations_by_user']
-            reservations_by_book = data['reservations_by_book']
-
-            # Create set of active reservation IDs for O(1) lookup
-            active_reservation_ids = {
-                str(row.reservation_id)
-                for row in active_reservations
-            }
+            update_main = get_prepared(UPDATE_RESERVATION_STATUS)
+            update_by_user = get_prepared(UPDATE_BY_USER_STATUS)
+            update_by_book = get_prepared(UPDATE_BY_BOOK_STATUS)
+
+            # Pending updates grouped by (table, partition key) so that
+            # every batch stays within a single partition
+            pending = defaultdict(list)
+
+            # Mismatches in every table were found while loading
+            for reservation_id, current_status, new_status in data[
+                'reservation_status_fixes'
+            ]:
+                logger.warning(
+                    "Reservation %s should be %s but is '%s'",
+                    reservation_id, new_status, current_status
+                )
+                pending[('reservations', reservation_id)].append(
+                    (update_main, (new_status, now, reservation_id))
+                )
+                fixed_count += 1
 
-            # Check main reservations table
-            for reservation in all_reservations:
-                reservation_id_str = str(reservation.reservation_id)
-                should_be_active = reservation_id_str in active_reservation_ids
-                current_status = reservation.status
+            for user_id, reservation_id, _, new_status in data[
+                'by_user_status_fixes'
+            ]:
+                pending[('reservations_by_user', user_id)].append(
+                    (update_by_user, (new_status, user_id, reservation_id))
+                )
+                fixed_count += 1
 
-                if should_be_active and current_status != 'active':
-                    logger.warning(
-                        f"Reservation {reservation_id_str} should be "
-                        f"active but is '{current_status}'"
-                    )
-                    update_query = """
-                        UPDATE reservations
-                        SET status = 'active', updated_at = %s
-                        WHERE reservation_id = %s
-                    """
-                    await execute_async(
-                        update_query,
-                        (datetime.utcnow(), reservation.reservation_id)
-                    )
-                    fixed_count += 1
+            for book_id, reservation_id, _, new_status in data[
+                'by_book_status_fixes'
+            ]:
+                pending[('reservations_by_book', book_id)].append(
+                    (update_by_book, (new_status, book_id, reservation_id))
+                )
+                fixed_count += 1
 
-                elif not should_be_active and current_status == 'active':
-                    logger.warning(
-                        f"Reservation {reservation_id_str} should be "
-                        "completed but is active"
-                    )
-                    update_query = """
-                        UPDATE reservations
-                        SET status = 'completed', updated_at = %s
-                        WHERE reservation_id = %s
-                    """
-                    await execute_async(
-                        update_query,
-                        (datetime.utcnow(), reservation.reservation_id)
-                    )
-                    fixed_count += 1
+            await self._execute_batched(pending)
 
-            # Check reservations_by_user table
-            for reservation in reservations_by_user:
-                reservation_id_str = str(reservation.reservation_id)
-                should_be_active = reservation_id_str in active_reservation_ids
-                current_status = reservation.status
-
-                if should_be_active and current_status != 'active':
-                    update_query = """
-                        UPDATE reservations_by_user
-                        SET status = 'active'
-                        WHERE user_id = %s AND reservation_id = %s
-                    """
-                    await execute_async(
-                        update_query,
-                        (reservation.user_id, reservation.reservation_id)
-                    )
-                    fixed_count += 1
+            return fixed_count
 
-                elif not should_be_active and current_status == 'active':
-                    update_query = """
-                        UPDATE reservations_by_user
-                        SET status = 'completed'
-                        WHERE user_id = %s AND reservation_id = %s
-                    """
-                    await execute_async(
-                        update_query,
-                        (reservation.user_id, reservation.reservation_id)
-                    )
-                    fixed_count += 1
+        except Exception as e:
+            logger.error("Error syncing reservation statuses: %s", e)
+            return 0
 
-            # Check reservations_by_book table
-            for reservation in reservations_by_book:
-                reservation_id_str = str(reservation.reservation_id)
-                should_be_active = reservation_id_str in active_reservation_ids
-                current_status = reservation.status
-
-                if should_be_active and current_status != 'active':
-                    update_query = """
-                        UPDATE reservations_by_book
-                        SET status = 'active'
-                        WHERE book_id = %s AND reservation_id = %s
-                    """
-                    await execute_async(
-                        update_query,
-                        (reservation.book_id, reservation.reservation_id)
-                    )
-                    fixed_count += 1
+    async def _execute_batched(self, pending):
+        """Flush grouped statements as single-partition UNLOGGED batches"""
+        batches = []
+        for statements in pending.values():
+            for start in range(0, len(statements), BATCH_SIZE):
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for prepared, parameters in statements[
+                    start:start + BATCH_SIZE
+                ]:
+                    batch.add(prepared, parameters)
+                batches.append(execute_async(batch))
+
+        await self._gather_in_chunks(batches)
+
+    async def _gather_in_chunks(self, coros):
+        """Run independent repair queries concurrently in bounded chunks"""
+        results = []
+        for start in range(0, len(coros), GATHER_CHUNK_SIZE):
+            chunk = coros[start:start + GATHER_CHUNK_SIZE]
+            results.extend(
+                await asyncio.gather(*chunk, return_exceptions=True)
+            )
 
-                elif not should_be_active and current_status == 'active':
-                    update_query = """
-                        UPDATE reservations_by_book
-                        SET status = 'completed'
-                        WHERE book_id = %s AND reservation_id = %s
-                    """
-                    await execute_async(
-                        update_query,
-                        (reservation.book_id, reservation.reservation_id)
-                    )
-                    fixed_count += 1
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Repair query failed: %s", result)
+
+        return results
+
+    async def _sync_active_counts(self, data):
+        """Ensure each user's active_count matches their reservations"""
+        fixed_count = 0
+
+        try:
+            adjust_count = get_prepared(ADJUST_ACTIVE_COUNT)
+
+            # Differences were found while loading reservations_user_book
+            # and user_counters, less any duplicates cancelled since
+            updates = []
+            for user_id, delta in data['active_count_fixes'].items():
+                if delta == 0:
+                    continue
+                logger.warning(
+                    "Active count of user %s is off by %d", user_id, -delta
+                )
+                updates.append(execute_async(adjust_count, (delta, user_id)))
+                fixed_count += 1
+
+            await self._gather_in_chunks(updates)
 
             return fixed_count
 
         except Exception as e:
-            logger.error(f"Error syncing reservation statuses: {e}")
+            logger.error("Error syncing active counts: %s", e)
             return 0
 
     async def _validate_final_state(self, data):
         """Final validation to ensure everything is consistent"""
         try:
-            active_reservations = data['active_reservations']
-            all_books = data['all_books']
+            book_reservations = data['book_reservations']
 
             # Count active reservations and checked out books
-            user_book_count = len(active_reservations)
-            checked_out_books = [
-                book for book in all_books
-                if book.status == 'checked_out'
-            ]
-            checked_count = len(checked_out_books)
+            user_book_count = data['active_count']
+            checked_count = data['checked_out_count']
 
             logger.info("Final state validation:")
             logger.info(
-                "  Active reservations in user_book "
-                f"table: {user_book_count}"
+                "  Active reservations in user_book table: %d",
+                user_book_count
             )
-            logger.info(f"  Checked out books: {checked_count}")
+            logger.info("  Checked out books: %d", checked_count)
 
             # These counts should match
             if user_book_count != checked_count:
                 logger.error(
-                    "CONSISTENCY ERROR: "
-                    "Active reservations ({user_book_count}) "
-                    "don't match checked out books ({checked_count})"
+                    "CONSISTENCY ERROR: Active reservations (%d) "
+                    "don't match checked out books (%d)",
+                    user_book_count, checked_count
                 )
             else:
                 logger.info(
@@ -488,32 +764,25 @@ class DataConsistencyChecker:
 
             # Check for duplicate active reservations
             # (books reserved by multiple users)
-            book_reservation_count = {}
-            for reservation in active_reservations:
-                book_id = str(reservation.book_id)
-                book_reservation_count[book_id] = (
-                    book_reservation_count.get(book_id, 0) + 1
-                )
-
             duplicates_found = 0
-            for book_id, count in book_reservation_count.items():
-                if count > 1:
-                    logger.error(
-                        f"DUPLICATE RESERVATION: Book {book_id} "
-                        f"has {count} active reservations"
-                    )
-                    duplicates_found += 1
+            for book_id in data['duplicate_book_ids']:
+                logger.error(
+                    "DUPLICATE RESERVATION: Book %s has %d "
+                    "active reservations",
+                    book_id, len(book_reservations[book_id])
+                )
+                duplicates_found += 1
 
             if duplicates_found == 0:
                 logger.info("✅ No duplicate active reservations found")
             else:
                 logger.error(
-                    f"❌ Found {duplicates_found} books "
-                    "with duplicate active reservations"
+                    "❌ Found %d books with duplicate active reservations",
+                    duplicates_found
                 )
 
         except Exception as e:
-            logger.error(f"Error during final validation: {e}")
+            logger.error("Error during final validation: %s", e)
 
 
 # Global instance
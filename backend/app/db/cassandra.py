@@ -1,14 +1,31 @@
-from typing import Optional
-from cassandra.cluster import Cluster, Session  # type: ignore
-from cassandra.policies import DCAwareRoundRobinPolicy  # type: ignore
+from typing import AsyncIterator, Iterable, Optional
+from cassandra.cluster import (  # type: ignore
+    Cluster,
+    Session,
+    ExecutionProfile,
+    EXEC_PROFILE_DEFAULT
+)
+from cassandra.cluster import ResultSet  # type: ignore
+from cassandra.query import PreparedStatement  # type: ignore
+from cassandra.policies import (  # type: ignore
+    DCAwareRoundRobinPolicy,
+    TokenAwarePolicy
+)
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import os
 
+# The driver falls back to its slow asyncore reactor when the libev
+# extension is missing, so prefer libev and fall back to asyncio instead
+try:
+    from cassandra.io.libevreactor import (  # type: ignore
+        LibevConnection as ConnectionClass
+    )
+except ImportError:
+    from cassandra.io.asyncioreactor import (  # type: ignore
+        AsyncioConnection as ConnectionClass
+    )
 
-cluster = None
-session = None
-executor = ThreadPoolExecutor(max_workers=10)
 
 logger = logging.getLogger(__name__)
 
@@ -16,36 +33,66 @@ logger = logging.getLogger(__name__)
 cluster: Optional[Cluster] = None
 session: Optional[Session] = None
 
+# Prepared statements keyed by their CQL text. Filled at startup by
+# prepare_statements(), and lazily on first use for anything else
+prepared_cache: dict[str, PreparedStatement] = {}
+
+# Upper bound on queries in flight at once. Protocol v5 multiplexes all
+# requests over a single connection per host, so this is what sizes the
+# pool to the expected concurrency instead of per-host connection counts
+MAX_IN_FLIGHT = int(os.environ.get("CASSANDRA_MAX_IN_FLIGHT", 1024))
+in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+# Rows fetched per page by execute_paged()
+PAGE_SIZE = int(os.environ.get("CASSANDRA_PAGE_SIZE", 500))
+
 
 async def init_cassandra() -> None:
     global cluster, session
     try:
+        # Route each request straight to a replica owning the partition
+        # instead of a round-robin coordinator that has to forward it.
+        # Protocol v5 multiplexes requests over one connection per host,
+        # so the driver does not need any per-connection pool tuning
+        profile = ExecutionProfile(
+            load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),
+            request_timeout=15.0
+        )
         cluster = Cluster(
             contact_points=[('127.0.0.1', 9042), ('127.0.0.1', 9043)],
             connect_timeout=10,
-            load_balancing_policy=DCAwareRoundRobinPolicy(),
-            protocol_version=5
+            execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+            protocol_version=5,
+            connection_class=ConnectionClass
         )
 
         session = cluster.connect()
-        keyspace_query = """
+        # Place replicas per data center, as the DC-aware load balancing
+        # above expects. The docker-compose nodes share one data center,
+        # whose name is read from the node rather than assumed
+        local_dc = session.execute(
+            "SELECT data_center FROM system.local"
+        ).one().data_center
+        keyspace_query = f"""
         CREATE KEYSPACE IF NOT EXISTS data
-        WITH REPLICATION = {
-            'class': 'SimpleStrategy',
-            'replication_factor': 2
-        }
+        WITH REPLICATION = {{
+            'class': 'NetworkTopologyStrategy',
+            '{local_dc}': 2
+        }}
         """
         session.execute(keyspace_query)
 
         print("✓ Keyspace 'data' created successfully")
-        session = cluster.connect('data')
+        # Keep the one session for the whole process rather than opening
+        # a second one bound to the keyspace
+        session.set_keyspace('data')
 
         # Create tables if they don't exist
         await create_tables()
 
         print("Connected to Cassandra and tables initialized")
     except Exception as e:
-        logger.error(f"Failed to connect to Cassandra: {e}")
+        logger.error("Failed to connect to Cassandra: %s", e)
         raise
 
 
@@ -64,6 +111,62 @@ def get_session() -> Session:
     return session
 
 
+def get_prepared(cql: str) -> PreparedStatement:
+    """Prepare a CQL statement once and reuse it on subsequent calls"""
+    prepared = prepared_cache.get(cql)
+    if prepared is None:
+        prepared = get_session().prepare(cql)
+        prepared_cache[cql] = prepared
+    return prepared
+
+
+def prepare_statements(statements: Iterable[str]) -> None:
+    """Prepare statements up front so no request waits on a prepare"""
+    for cql in statements:
+        prepared = get_prepared(cql)
+        # Statements with bind markers all address a partition, so each one
+        # should carry a routing key for the token-aware policy. Without it
+        # every call pays an extra hop through a coordinator
+        if "?" in cql and prepared.routing_key_indexes is None:
+            logger.warning(
+                "Prepared statement has no routing key: %s",
+                " ".join(cql.split())
+            )
+
+
+def _resolve(future, response_future):
+    if not future.done():
+        # The response has already arrived, so result() does not block
+        future.set_result(response_future.result())
+
+
+def _reject(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+
+def _result_future(response_future) -> "asyncio.Future[ResultSet]":
+    # The driver completes the request on its own IO thread, so hand the
+    # outcome back to the event loop instead of blocking
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    response_future.add_callbacks(
+        lambda _: loop.call_soon_threadsafe(
+            _resolve, future, response_future
+        ),
+        lambda exc: loop.call_soon_threadsafe(_reject, future, exc)
+    )
+    return future
+
+
+def _release_prefetch(future):
+    in_flight.release()
+    # Mark a failure as seen even if the caller stopped reading before
+    # awaiting this page. It is still raised to a caller that awaits it
+    if not future.cancelled():
+        future.exception()
+
+
 async def execute_async(query, parameters=None):
     """Execute Cassandra query asynchronously"""
     if session is None:
@@ -71,22 +174,76 @@ async def execute_async(query, parameters=None):
             "Cassandra session is not initialized. "
             "Call init_cassandra() first."
         )
-    loop = asyncio.get_event_loop()
     try:
-        if parameters:
-            result = await loop.run_in_executor(
-                executor, session.execute, query, parameters
-            )
-        else:
-            result = await loop.run_in_executor(
-                executor, session.execute, query
+        async with in_flight:
+            return await _result_future(
+                session.execute_async(query, parameters or None)
             )
-        return result
     except Exception as e:
-        logger.error(f"Database error during query execution: {e}")
+        logger.error("Database error during query execution: %s", e)
         raise
 
 
+async def gather_bounded(coros, limit):
+    """Await coroutines concurrently with at most limit running at once"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+
+async def execute_paged(
+    query: PreparedStatement, parameters=None, fetch_size: int = PAGE_SIZE
+) -> AsyncIterator[tuple[list, bool]]:
+    """Execute a prepared query, yielding (rows, has_more_pages) per page
+
+    Iterating a ResultSet fetches the pages after the first one
+    synchronously, so this awaits each page instead. The next page is
+    requested before the current one is yielded, so its round trip
+    overlaps whatever the caller does with these rows.
+    """
+    statement = query.bind(parameters or ())
+    statement.fetch_size = fetch_size
+    result = await execute_async(statement)
+    while result.has_more_pages:
+        response_future = result.response_future
+        # The callbacks for the previous page are still attached and
+        # would fire again for this one
+        response_future.clear_callbacks()
+
+        # The prefetch holds an in-flight slot until its page arrives,
+        # however long the caller takes with the current one
+        await in_flight.acquire()
+        try:
+            response_future.start_fetching_next_page()
+        except Exception:
+            in_flight.release()
+            raise
+        next_page = _result_future(response_future)
+        next_page.add_done_callback(_release_prefetch)
+
+        # The ResultSet keeps its own rows, so fetching ahead does not
+        # replace them
+        yield result.current_rows, True
+        try:
+            result = await next_page
+        except Exception as e:
+            logger.error("Database error while fetching next page: %s", e)
+            raise
+
+    yield result.current_rows, False
+
+
+async def resume_pages(first_page, pages):
+    """Yield first_page, already taken from pages, then the rest of pages"""
+    yield first_page
+    async for page in pages:
+        yield page
+
+
 async def create_tables():
     """Create all necessary tables"""
     tables = [
@@ -150,11 +307,26 @@ async def create_tables():
         )
         """,
         """
+        CREATE TABLE IF NOT EXISTS books_by_status (
+            status TEXT,
+            book_id UUID,
+            title TEXT,
+            created_at TIMESTAMP,
+            PRIMARY KEY (status, book_id)
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS users (
             user_id UUID PRIMARY KEY,
             username TEXT,
             created_at TIMESTAMP
         )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id UUID PRIMARY KEY,
+            active_count COUNTER
+        )
         """
     ]
 
@@ -162,5 +334,5 @@ async def create_tables():
         try:
             await execute_async(table_query)
         except Exception as e:
-            logger.error(f"Failed to create table: {e}")
+            logger.error("Failed to create table: %s", e)
             raise
@@ -1,22 +1,195 @@
+import json
+import logging
+import uuid
+from datetime import datetime
+from functools import lru_cache
+
 import tornado
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Headers sent with every response, built once at import time
+DEFAULT_HEADERS = (
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Headers", "Content-Type"),
+    ("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS"),
+    ("Content-Type", "application/json"),
+)
+
+# Largest request body the API accepts. Every endpoint takes a small JSON
+# object, so anything bigger is rejected before it is parsed
+MAX_BODY_SIZE = 64 * 1024
+
+# Largest list response write_list() keeps in a cache. Longer lists are
+# streamed every time rather than held in memory
+MAX_CACHED_LIST_SIZE = 4 * 1024 * 1024
+
+
+def load_json(body):
+    """Decode a JSON request body, using orjson when it is installed"""
+    if orjson is not None:
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError, so the
+        # handlers' existing error handling still applies
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def parse_uuid(value):
+    """Parse a UUID sent by a client, raising ValueError if it is not one"""
+    # Also rejects unhashable JSON values before they reach the cache
+    if not isinstance(value, str):
+        raise ValueError("badly formed hexadecimal UUID string")
+    return _parse_uuid_str(value)
+
+
+# The same IDs are requested over and over, and UUIDs are immutable, so
+# parsed ones can be shared. Failures raise and are never cached
+@lru_cache(maxsize=4096)
+def _parse_uuid_str(value):
+    # Accepts every form uuid.UUID() does, including the braced and
+    # urn:uuid: ones, and raises ValueError for anything else
+    return uuid.UUID(value)
+
+
+def _encode_default(obj):
+    # The same forms orjson produces for these types natively
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(obj):
+    """Encode obj as JSON bytes, using orjson when it is installed
+
+    UUIDs and datetimes are encoded as their str() and isoformat() forms,
+    so responses can hold row values as they come from the driver.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_encode_default).encode()
+
+
+# Body sent for unexpected errors, encoded once. The exception's own message
+# is only sent when tracebacks are served, as it can expose internals
+INTERNAL_ERROR_BODY = dump_json({
+    "error": "Internal server error",
+    "status_code": 500
+})
+
 
 class BaseHandler(tornado.web.RequestHandler):
     def set_default_headers(self):
-        self.set_header("Access-Control-Allow-Origin", "*")
-        self.set_header("Access-Control-Allow-Headers", "Content-Type")
-        self.set_header(
-            "Access-Control-Allow-Methods",
-            "GET, POST, PUT, DELETE, OPTIONS"
-        )
-        self.set_header("Content-Type", "application/json")
+        set_header = self.set_header
+        for name, value in DEFAULT_HEADERS:
+            set_header(name, value)
+
+    def prepare(self):
+        if len(self.request.body) > MAX_BODY_SIZE:
+            # 413 is already the missing username error of POST /api/users,
+            # so this gets the next code no handler uses
+            raise tornado.web.HTTPError(
+                440, reason="Request body too large"
+            )
+
+    def write(self, chunk):
+        # Tornado's own JSON encoding cannot handle UUIDs or datetimes
+        if isinstance(chunk, dict):
+            chunk = dump_json(chunk)
+        super().write(chunk)
+
+    async def write_list(
+        self, envelope, key, pages, build, count_key,
+        cache=None, cache_key=None
+    ):
+        """Write envelope with every row from pages listed under key
+
+        Each page is written and flushed as it arrives, so only one page is
+        held in memory however long the list is. The number of rows is
+        added under count_key after the list.
+
+        If a cache is given, a response cached under cache_key is written
+        instead of reading pages, and a new response is cached if it is no
+        larger than MAX_CACHED_LIST_SIZE.
+        """
+        parts = None
+        if cache is not None:
+            body = cache.peek(cache_key)
+            if body is not None:
+                self.write(body)
+                return
+            token = cache.reserve(cache_key)
+            parts = []
+            size = 0
+
+        head = dump_json(envelope)[:-1]
+        if envelope:
+            head += b","
+        chunk = head + dump_json(key) + b":["
+        self.write(chunk)
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+
+        count = 0
+        flushed = False
+        try:
+            async for rows, has_more_pages in pages:
+                encoded = [dump_json(build(row)) for row in rows]
+                if encoded:
+                    chunk = (b"," if count else b"") + b",".join(encoded)
+                    self.write(chunk)
+                    count += len(encoded)
+                    if parts is not None:
+                        size += len(chunk)
+                        if size > MAX_CACHED_LIST_SIZE:
+                            # Too long to cache, so stop keeping a copy
+                            parts = None
+                            cache.discard(cache_key, token)
+                        else:
+                            parts.append(chunk)
+                if has_more_pages:
+                    # Send what there is while the next page is fetched
+                    await self.flush()
+                    flushed = True
+        except Exception:
+            if parts is not None:
+                cache.discard(cache_key, token)
+            if not flushed:
+                # Nothing was sent yet, so the caller can still respond
+                # with an error instead
+                self.clear()
+                raise
+            # The status line is already out, so the response can only be
+            # cut short. Dropping the connection tells the client it is
+            # incomplete
+            logger.exception("Failed while streaming %s", key)
+            self.request.connection.close()
+            return
+
+        tail = b"]," + dump_json(count_key) + b":" + dump_json(count) + b"}"
+        self.write(tail)
+        if parts is not None:
+            parts.append(tail)
+            cache.put(cache_key, token, b"".join(parts))
 
     def options(self, *args, **kwargs):
         self.set_status(204)
         self.finish()
 
     def write_error(self, status_code, **kwargs):
-        self.set_header("Content-Type", "application/json")
+        # send_error() clears the response first, which re-applies the
+        # default headers, so Content-Type is already set here
+        if status_code == 500 and not self.settings.get("serve_traceback"):
+            self.write(INTERNAL_ERROR_BODY)
+            return
+
         error_message = "An error occurred"
 
         if "exc_info" in kwargs:
@@ -1,19 +1,351 @@
+import asyncio
 import json
-import uuid
-from datetime import datetime, timedelta
-from handlers.base_handler import BaseHandler
-from db.cassandra import execute_async  # type: ignore
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from cassandra.util import uuid_from_time  # type: ignore
+from handlers.base_handler import BaseHandler, load_json, parse_uuid
+from db.cassandra import (  # type: ignore
+    execute_async,
+    gather_bounded,
+    get_prepared
+)
 import logging
+from cache import TTLCache
 from consistency_checker import mark_write_activity
+from handlers.user_book_handler import invalidate_book_lists
 
 logger = logging.getLogger(__name__)
 
+# How long a new reservation lasts before the book is due back
+DEFAULT_LOAN_PERIOD = timedelta(days=14)
+
+SELECT_USERNAME = "SELECT username FROM users WHERE user_id = ?"
+SELECT_BOOK = (
+    "SELECT title, status, created_at FROM books WHERE book_id = ?"
+)
+SELECT_BOOK_LISTING = "SELECT title, created_at FROM books WHERE book_id = ?"
+SELECT_RESERVATION = (
+    "SELECT reservation_id, user_id, book_id, user_name, book_title, "
+    "status, reservation_date, return_deadline, created_at, updated_at "
+    "FROM reservations WHERE reservation_id = ?"
+)
+# Just what bulk cancel needs to complete a reservation
+SELECT_RESERVATION_KEYS = (
+    "SELECT reservation_id, user_id, book_id, status "
+    "FROM reservations WHERE reservation_id = ?"
+)
+
+# Claims the user/book pair in reservations_user_book (only active
+# reservations); not applied if the user already holds this book
+INSERT_USER_BOOK = (
+    "INSERT INTO reservations_user_book "
+    "(user_id, book_id, reservation_id, user_name, book_title, "
+    "reservation_date, return_deadline, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) IF NOT EXISTS"
+)
+INSERT_RESERVATION = (
+    "INSERT INTO reservations ("
+    "reservation_id, user_id, book_id, user_name, book_title, "
+    "status, reservation_date, return_deadline, created_at, "
+    "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_BY_USER = (
+    "INSERT INTO reservations_by_user "
+    "(user_id, reservation_id, book_id, book_title, "
+    "status, reservation_date, return_deadline) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_BY_BOOK = (
+    "INSERT INTO reservations_by_book "
+    "(book_id, reservation_id, user_id, user_name, "
+    "status, reservation_date, return_deadline) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+CHECK_OUT_BOOK = "UPDATE books SET status = 'checked_out' WHERE book_id = ?"
+RETURN_BOOK = "UPDATE books SET status = 'available' WHERE book_id = ?"
+# A book's row in books_by_status moves partition whenever its status flips
+INSERT_BOOK_BY_STATUS = (
+    "INSERT INTO books_by_status (status, book_id, title, created_at) "
+    "VALUES (?, ?, ?, ?)"
+)
+DELETE_BOOK_BY_STATUS = (
+    "DELETE FROM books_by_status WHERE status = ? AND book_id = ?"
+)
+
+# Main-table UPDATE for each combination of fields a PUT can change
+UPDATE_RESERVATION_QUERIES = {
+    ('status',): (
+        "UPDATE reservations SET status = ?, updated_at = ? "
+        "WHERE reservation_id = ?"
+    ),
+    ('return_deadline',): (
+        "UPDATE reservations SET return_deadline = ?, updated_at = ? "
+        "WHERE reservation_id = ?"
+    ),
+    ('status', 'return_deadline'): (
+        "UPDATE reservations SET status = ?, return_deadline = ?, "
+        "updated_at = ? WHERE reservation_id = ?"
+    ),
+}
+UPDATE_BY_USER_STATUS = (
+    "UPDATE reservations_by_user SET status = ? "
+    "WHERE user_id = ? AND reservation_id = ?"
+)
+UPDATE_BY_BOOK_STATUS = (
+    "UPDATE reservations_by_book SET status = ? "
+    "WHERE book_id = ? AND reservation_id = ?"
+)
+UPDATE_BY_USER_DEADLINE = (
+    "UPDATE reservations_by_user SET return_deadline = ? "
+    "WHERE user_id = ? AND reservation_id = ?"
+)
+UPDATE_BY_BOOK_DEADLINE = (
+    "UPDATE reservations_by_book SET return_deadline = ? "
+    "WHERE book_id = ? AND reservation_id = ?"
+)
+# reservations_user_book rows are claimed with a lightweight transaction,
+# which is timestamped by the server. Plain writes to the same rows carry
+# client timestamps that may be later than the next claim and hide it, so
+# every write to the table is conditional as well
+UPDATE_ACTIVE_DEADLINE = (
+    "UPDATE reservations_user_book SET return_deadline = ? "
+    "WHERE user_id = ? AND book_id = ? IF EXISTS"
+)
+# Each user's number of active reservations, read by UserHandler
+ADJUST_ACTIVE_COUNT = (
+    "UPDATE user_counters SET active_count = active_count + ? "
+    "WHERE user_id = ?"
+)
+DELETE_ACTIVE = (
+    "DELETE FROM reservations_user_book "
+    "WHERE user_id = ? AND book_id = ? IF EXISTS"
+)
+
+# Every statement above, prepared once at startup
+STATEMENTS = (
+    SELECT_USERNAME,
+    SELECT_BOOK,
+    SELECT_BOOK_LISTING,
+    SELECT_RESERVATION,
+    SELECT_RESERVATION_KEYS,
+    INSERT_USER_BOOK,
+    INSERT_RESERVATION,
+    INSERT_BY_USER,
+    INSERT_BY_BOOK,
+    CHECK_OUT_BOOK,
+    RETURN_BOOK,
+    INSERT_BOOK_BY_STATUS,
+    DELETE_BOOK_BY_STATUS,
+    *UPDATE_RESERVATION_QUERIES.values(),
+    UPDATE_BY_USER_STATUS,
+    UPDATE_BY_BOOK_STATUS,
+    UPDATE_BY_USER_DEADLINE,
+    UPDATE_BY_BOOK_DEADLINE,
+    UPDATE_ACTIVE_DEADLINE,
+    DELETE_ACTIVE,
+    ADJUST_ACTIVE_COUNT,
+)
+
+
+# Reservation responses are cached briefly so that repeated and concurrent
+# reads of the same reservation share a single query. Writes made through
+# the handlers below invalidate the affected entries
+reservation_cache = TTLCache(ttl=2.0, maxsize=4096)
+
+# Reservations a bulk cancel works on at once, unless the request asks for
+# another limit up to MAX_BULK_CONCURRENCY. This keeps one large request
+# from taking up the whole in-flight query limit shared by all handlers
+BULK_CONCURRENCY = 64
+MAX_BULK_CONCURRENCY = 256
+# Bulk cancels listing more IDs than this are logged
+LARGE_BULK_SIZE = 1000
+
+
+async def return_book(book_id):
+    """Mark a book available again in books and books_by_status"""
+    # books_by_status repeats the title and created_at, so read them while
+    # the status itself is being updated
+    result, _ = await asyncio.gather(
+        execute_async(get_prepared(SELECT_BOOK_LISTING), (book_id,)),
+        execute_async(get_prepared(RETURN_BOOK), (book_id,))
+    )
+    if not result:
+        return
+
+    book = result[0]
+    await asyncio.gather(
+        execute_async(
+            get_prepared(DELETE_BOOK_BY_STATUS), ('checked_out', book_id)
+        ),
+        execute_async(
+            get_prepared(INSERT_BOOK_BY_STATUS),
+            ('available', book_id, book.title, book.created_at)
+        )
+    )
+
+
+async def release_active(user_id, book_id):
+    """Remove a user's active reservation of a book and count it off
+
+    The counter is only decremented if the conditional delete removed the
+    row, so requests completing the same reservation at once count it off
+    a single time. Returns whether this call removed the row.
+    """
+    result = await execute_async(
+        get_prepared(DELETE_ACTIVE), (user_id, book_id)
+    )
+    if result.was_applied:
+        await execute_async(
+            get_prepared(ADJUST_ACTIVE_COUNT), (-1, user_id)
+        )
+    return result.was_applied
+
+
+async def complete_active(user_id, book_id):
+    """Release a user's active reservation of a book and return the book
+
+    The book is only returned if the reservation was still active, so
+    completing an already completed reservation leaves the book alone.
+    Returns whether the book was returned.
+    """
+    if not await release_active(user_id, book_id):
+        return False
+    await return_book(book_id)
+    return True
+
+
+# A reservations row, with its columns in the order SELECT_RESERVATION and
+# INSERT_RESERVATION list them. Rows read from the driver have the same
+# fields, so both can be passed to reservation_entry()
+Reservation = namedtuple("Reservation", (
+    "reservation_id", "user_id", "book_id", "user_name", "book_title",
+    "status", "reservation_date", "return_deadline", "created_at",
+    "updated_at"
+))
+
+
+def reservation_entry(reservation):
+    """Response body for a reservations row"""
+    return {
+        "reservation_id": reservation.reservation_id,
+        "user_id": reservation.user_id,
+        "book_id": reservation.book_id,
+        "user_name": reservation.user_name,
+        "book_title": reservation.book_title,
+        "status": reservation.status,
+        "reservation_date": reservation.reservation_date,
+        "return_deadline": reservation.return_deadline,
+        "created_at": reservation.created_at,
+        "updated_at": reservation.updated_at
+    }
+
+
+async def load_reservation(reservation_uuid):
+    """Fetch a reservation as a response dict, or None if it does not exist"""
+    result = await execute_async(
+        get_prepared(SELECT_RESERVATION), (reservation_uuid,)
+    )
+
+    if not result:
+        return None
+    return reservation_entry(result[0])
+
+
+async def create_reservation(user_id, book_id):
+    """Reserve a book for a user, returning a status code and response body"""
+    # The user and book lookups are independent, so run them
+    # concurrently
+    user_result, book_result = await asyncio.gather(
+        execute_async(get_prepared(SELECT_USERNAME), (user_id,)),
+        execute_async(get_prepared(SELECT_BOOK), (book_id,))
+    )
+
+    # Check if user exists
+    if not user_result:
+        return 404, {"error": "User not found"}
+
+    user_name = user_result[0].username
+
+    # Check if book exists and is available
+    if not book_result:
+        return 404, {"error": "Book not found"}
+
+    book_title = book_result[0].title
+    book_status = book_result[0].status
+    book_created_at = book_result[0].created_at
+
+    if book_status != 'available':
+        return 416, {"error": "Book is not available for reservation"}
+
+    # Create reservation. The ID is a time-based UUID, which Cassandra sorts
+    # by its timestamp, so the by_user and by_book tables list the newest
+    # reservations first instead of in random order. Cassandra compares the
+    # UUID version before the timestamp, though, so random (version 4) IDs
+    # created before this change are still listed ahead of every
+    # time-based one
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    reservation_id = uuid_from_time(now)
+    return_deadline = now + DEFAULT_LOAN_PERIOD
+
+    # Claim the user/book pair first. The conditional insert fails if
+    # the user already has an active reservation for this book, so
+    # two concurrent requests cannot both succeed
+    claim_result = await execute_async(
+        get_prepared(INSERT_USER_BOOK),
+        (
+            user_id, book_id, reservation_id, user_name, book_title,
+            now, return_deadline, now
+        )
+    )
+
+    if not claim_result.was_applied:
+        return 417, {
+            "error": "User already has an active reservation for this book"
+        }
+
+    reservation = Reservation(
+        reservation_id, user_id, book_id, user_name, book_title,
+        'active', now, return_deadline, now, now
+    )
+
+    # Insert into the reservation tables and check the book out,
+    # moving it to the checked_out listing in books_by_status. The
+    # statements target different partitions and do not depend on
+    # each other, so send them concurrently rather than as a
+    # multi-partition batch
+    await asyncio.gather(
+        execute_async(get_prepared(INSERT_RESERVATION), reservation),
+        execute_async(get_prepared(INSERT_BY_USER), (
+            user_id, reservation_id, book_id, book_title,
+            'active', now, return_deadline
+        )),
+        execute_async(get_prepared(INSERT_BY_BOOK), (
+            book_id, reservation_id, user_id, user_name,
+            'active', now, return_deadline
+        )),
+        execute_async(get_prepared(CHECK_OUT_BOOK), (book_id,)),
+        execute_async(
+            get_prepared(ADJUST_ACTIVE_COUNT), (1, user_id)
+        ),
+        execute_async(
+            get_prepared(DELETE_BOOK_BY_STATUS), ('available', book_id)
+        ),
+        execute_async(
+            get_prepared(INSERT_BOOK_BY_STATUS),
+            ('checked_out', book_id, book_title, book_created_at)
+        )
+    )
+    invalidate_book_lists()
+
+    return 201, reservation_entry(reservation)
+
 
 class ReservationHandler(BaseHandler):
     async def post(self):
         """Create a new reservation"""
         try:
-            data = json.loads(self.request.body)
+            data = load_json(self.request.body)
 
             # Validate required fields
             required_fields = ['user_id', 'book_id']
@@ -23,135 +355,14 @@ class ReservationHandler(BaseHandler):
                     self.write({"error": f"Missing required field: {field}"})
                     return
 
-            user_id = uuid.UUID(data['user_id'])
-            book_id = uuid.UUID(data['book_id'])
-
-            # Check if user exists
-            user_query = "SELECT username FROM users WHERE user_id = %s"
-            user_result = await execute_async(user_query, (user_id,))
-            if not user_result:
-                self.set_status(404)
-                self.write({"error": "User not found"})
-                return
-
-            user_name = user_result[0].username
-
-            # Check if book exists and is available
-            book_query = "SELECT title, status FROM books WHERE book_id = %s"
-            book_result = await execute_async(book_query, (book_id,))
-            if not book_result:
-                self.set_status(404)
-                self.write({"error": "Book not found"})
-                return
-
-            book_title = book_result[0].title
-            book_status = book_result[0].status
-
-            if book_status != 'available':
-                self.set_status(416)
-                self.write({"error": "Book is not available for reservation"})
-                return
-
-            # Check if user already has an active reservation for this book
-            # using the new table
-            existing_reservation_query = """
-                SELECT reservation_id FROM reservations_user_book
-                WHERE user_id = %s AND book_id = %s
-            """
-            existing_result = await execute_async(
-                existing_reservation_query, (user_id, book_id)
-            )
-            if existing_result:
-                self.set_status(417)
-                self.write({
-                    "error": (
-                        "User already has an active "
-                        "reservation for this book"
-                    )
-                })
-                return
-
-            # Create reservation
-            reservation_id = uuid.uuid4()
-            now = datetime.utcnow()
-            return_deadline = now + timedelta(days=14)  # 2 weeks default
-
-            # Insert into main reservations table
-            insert_reservation = (
-                "INSERT INTO reservations ("
-                "reservation_id, user_id, book_id, user_name, book_title, "
-                "status, reservation_date, return_deadline, created_at, "
-                "updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-            )
+            user_id = parse_uuid(data['user_id'])
+            book_id = parse_uuid(data['book_id'])
 
-            # Insert into reservations_by_user table
-            insert_by_user = (
-                "INSERT INTO reservations_by_user "
-                "(user_id, reservation_id, book_id, book_title, "
-                "status, reservation_date, return_deadline) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s)"
-            )
-
-            # Insert into reservations_by_book table
-            insert_by_book = (
-                "INSERT INTO reservations_by_book "
-                "(book_id, reservation_id, user_id, user_name, "
-                "status, reservation_date, return_deadline) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s)"
-            )
-
-            # Insert into reservations_user_book table
-            # (only active reservations)
-            insert_user_book = (
-                "INSERT INTO reservations_user_book "
-                "(user_id, book_id, reservation_id, user_name, book_title, "
-                "reservation_date, return_deadline, created_at) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-            )
-
-            # Update book status
-            update_book = (
-                "UPDATE books SET status = 'checked_out' "
-                "WHERE book_id = %s"
-            )
-
-            # Execute all queries
-            await execute_async(insert_reservation, (
-                reservation_id, user_id, book_id, user_name, book_title,
-                'active', now, return_deadline, now, now
-            ))
-
-            await execute_async(insert_by_user, (
-                user_id, reservation_id, book_id, book_title,
-                'active', now, return_deadline
-            ))
-
-            await execute_async(insert_by_book, (
-                book_id, reservation_id, user_id, user_name,
-                'active', now, return_deadline
-            ))
-
-            await execute_async(insert_user_book, (
-                user_id, book_id, reservation_id, user_name, book_title,
-                now, return_deadline, now
-            ))
-
-            await execute_async(update_book, (book_id,))
-
-            self.set_status(201)
-            self.write({
-                "reservation_id": str(reservation_id),
-                "user_id": str(user_id),
-                "book_id": str(book_id),
-                "user_name": user_name,
-                "book_title": book_title,
-                "status": "active",
-                "reservation_date": now.isoformat(),
-                "return_deadline": return_deadline.isoformat(),
-                "created_at": now.isoformat(),
-                "updated_at": now.isoformat()
-            })
-            mark_write_activity()
+            status, body = await create_reservation(user_id, book_id)
+            self.set_status(status)
+            self.write(body)
+            if status == 201:
+                mark_write_activity()
 
         except json.JSONDecodeError:
             self.set_status(418)
@@ -160,7 +371,7 @@ class ReservationHandler(BaseHandler):
             self.set_status(419)
             self.write({"error": f"Invalid UUID format: {str(e)}"})
         except Exception as e:
-            logger.error(f"Error creating reservation: {str(e)}")
+            logger.error("Error creating reservation: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
@@ -169,47 +380,37 @@ class ReservationDetailHandler(BaseHandler):
     async def get(self, reservation_id):
         """Get a specific reservation"""
         try:
-            reservation_uuid = uuid.UUID(reservation_id)
+            reservation_uuid = parse_uuid(reservation_id)
 
-            query = "SELECT * FROM reservations WHERE reservation_id = %s"
-            result = await execute_async(query, (reservation_uuid,))
+            reservation = await reservation_cache.get(
+                reservation_uuid, lambda: load_reservation(reservation_uuid)
+            )
 
-            if not result:
+            if reservation is None:
                 self.set_status(404)
                 self.write({"error": "Reservation not found"})
                 return
 
-            reservation = result[0]
-            self.write({
-                "reservation_id": str(reservation.reservation_id),
-                "user_id": str(reservation.user_id),
-                "book_id": str(reservation.book_id),
-                "user_name": reservation.user_name,
-                "book_title": reservation.book_title,
-                "status": reservation.status,
-                "reservation_date": reservation.reservation_date.isoformat(),
-                "return_deadline": reservation.return_deadline.isoformat(),
-                "created_at": reservation.created_at.isoformat(),
-                "updated_at": reservation.updated_at.isoformat()
-            })
+            self.write(reservation)
 
         except ValueError:
             self.set_status(420)
             self.write({"error": "Invalid reservation ID format"})
         except Exception as e:
-            logger.error(f"Error fetching reservation: {str(e)}")
+            logger.error("Error fetching reservation: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
     async def put(self, reservation_id):
         """Update a reservation"""
         try:
-            reservation_uuid = uuid.UUID(reservation_id)
-            data = json.loads(self.request.body)
+            reservation_uuid = parse_uuid(reservation_id)
+            data = load_json(self.request.body)
 
             # Check if reservation exists
-            query = "SELECT * FROM reservations WHERE reservation_id = %s"
-            result = await execute_async(query, (reservation_uuid,))
+            result = await execute_async(
+                get_prepared(SELECT_RESERVATION), (reservation_uuid,)
+            )
 
             if not result:
                 self.set_status(404)
@@ -217,7 +418,7 @@ class ReservationDetailHandler(BaseHandler):
                 return
 
             reservation = result[0]
-            now = datetime.utcnow()
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
 
             # Determine what to update
             updates = {}
@@ -235,7 +436,7 @@ class ReservationDetailHandler(BaseHandler):
 
             if 'return_deadline' in data:
                 try:
-                    updates['return_deadline'] = datetime.fromisoformat(
+                    return_deadline = datetime.fromisoformat(
                         data['return_deadline'].replace('Z', '+00:00')
                     )
                 except ValueError:
@@ -247,132 +448,105 @@ class ReservationDetailHandler(BaseHandler):
                         )
                     })
                     return
+                if return_deadline.tzinfo is not None:
+                    # Stored as UTC either way, and Cassandra returns
+                    # timestamps naive, so keep the response consistent
+                    return_deadline = return_deadline.astimezone(
+                        timezone.utc
+                    ).replace(tzinfo=None)
+                updates['return_deadline'] = return_deadline
 
             if not updates:
                 self.set_status(423)
                 self.write({"error": "No valid fields to update"})
                 return
 
-            # Update main reservation
-            update_fields = []
-            update_values = []
-
-            for field, value in updates.items():
-                update_fields.append(f"{field} = %s")
-                update_values.append(value)
-
-            update_fields.append("updated_at = %s")
-            update_values.append(now)
-            update_values.append(reservation_uuid)
-
-            update_query = (
-                f"UPDATE reservations SET {', '.join(update_fields)} "
-                "WHERE reservation_id = %s"
-            )
-            await execute_async(update_query, update_values)
+            # Update main reservation. updates always lists status before
+            # return_deadline, so its keys select the statement directly
+            update_query = UPDATE_RESERVATION_QUERIES[tuple(updates)]
+            update_values = (*updates.values(), now, reservation_uuid)
+            statements = [(update_query, update_values)]
+            returned_book_id = None
 
             # Update denormalized tables if status changed
             if 'status' in updates:
-                update_by_user = (
-                    "UPDATE reservations_by_user SET status = %s "
-                    "WHERE user_id = %s AND reservation_id = %s"
-                )
-                await execute_async(
-                    update_by_user,
+                statements.append((
+                    UPDATE_BY_USER_STATUS,
                     (updates['status'], reservation.user_id, reservation_uuid)
-                )
+                ))
 
-                update_by_book = (
-                    "UPDATE reservations_by_book SET status = %s "
-                    "WHERE book_id = %s AND reservation_id = %s"
-                )
-                await execute_async(
-                    update_by_book,
+                statements.append((
+                    UPDATE_BY_BOOK_STATUS,
                     (updates['status'], reservation.book_id, reservation_uuid)
-                )
+                ))
 
                 # If marking as completed, remove from active reservations
                 # table and make book available
                 if updates['status'] == 'completed':
-                    delete_active = (
-                        "DELETE FROM reservations_user_book "
-                        "WHERE user_id = %s AND book_id = %s"
-                    )
-                    await execute_async(
-                        delete_active,
-                        (reservation.user_id, reservation.book_id)
-                    )
-
-                    update_book = (
-                        "UPDATE books SET status = 'available' "
-                        "WHERE book_id = %s"
-                    )
-                    await execute_async(update_book, (reservation.book_id,))
+                    returned_book_id = reservation.book_id
 
             # Update return_deadline in ALL tables that contain it
             if 'return_deadline' in updates:
                 # Update reservations_by_user table
-                update_by_user_deadline = (
-                    "UPDATE reservations_by_user SET return_deadline = %s "
-                    "WHERE user_id = %s AND reservation_id = %s"
-                )
-                await execute_async(
-                    update_by_user_deadline,
+                statements.append((
+                    UPDATE_BY_USER_DEADLINE,
                     (
                         updates['return_deadline'],
                         reservation.user_id,
                         reservation_uuid
                     )
-                )
+                ))
 
                 # Update reservations_by_book table
-                update_by_book_deadline = (
-                    "UPDATE reservations_by_book SET return_deadline = %s "
-                    "WHERE book_id = %s AND reservation_id = %s"
-                )
-                await execute_async(
-                    update_by_book_deadline,
+                statements.append((
+                    UPDATE_BY_BOOK_DEADLINE,
                     (
                         updates['return_deadline'],
                         reservation.book_id,
                         reservation_uuid
                     )
-                )
-
-                # If reservation is still active, update the active table too
-                if reservation.status == 'active':
-                    update_active_deadline = (
-                        "UPDATE reservations_user_book "
-                        "SET return_deadline = %s "
-                        "WHERE user_id = %s AND book_id = %s"
-                    )
-                    await execute_async(
-                        update_active_deadline,
+                ))
+
+                # If reservation is still active, update the active table too.
+                # Skip it when completing, as its row is deleted
+                if (
+                    reservation.status == 'active' and
+                    updates.get('status') != 'completed'
+                ):
+                    statements.append((
+                        UPDATE_ACTIVE_DEADLINE,
                         (
                             updates['return_deadline'],
                             reservation.user_id,
                             reservation.book_id
                         )
-                    )
-
-            # Return updated reservation
-            updated_reservation = await execute_async(
-                query, (reservation_uuid,)
-            )
-            reservation = updated_reservation[0]
-
-            self.write({
-                "reservation_id": str(reservation.reservation_id),
-                "user_id": str(reservation.user_id),
-                "book_id": str(reservation.book_id),
-                "user_name": reservation.user_name,
-                "book_title": reservation.book_title,
-                "status": reservation.status,
-                "reservation_date": reservation.reservation_date.isoformat(),
-                "return_deadline": reservation.return_deadline.isoformat(),
-                "created_at": reservation.created_at.isoformat(),
-                "updated_at": reservation.updated_at.isoformat()
-            })
+                    ))
+
+            # The statements touch separate partitions, so send them together
+            # rather than as a multi-partition batch. If one fails the PUT
+            # answers 500, and repeating it is safe, as the counter and the
+            # book only follow the conditional delete. Until then the
+            # consistency checker repairs statuses left stale in any table,
+            # but it does not compare return deadlines, so a failed deadline
+            # write stays until the deadline is set again
+            writes = [
+                execute_async(get_prepared(statement), values)
+                for statement, values in statements
+            ]
+            if returned_book_id is not None:
+                writes.append(
+                    complete_active(reservation.user_id, returned_book_id)
+                )
+            results = await asyncio.gather(*writes)
+            reservation_cache.invalidate(reservation_uuid)
+            if returned_book_id is not None and results[-1]:
+                invalidate_book_lists()
+
+            # Build the updated reservation from the row read above and the
+            # applied changes instead of reading it back
+            self.write(reservation_entry(
+                reservation._replace(**updates, updated_at=now)
+            ))
             mark_write_activity()
 
         except json.JSONDecodeError:
@@ -382,16 +556,139 @@ class ReservationDetailHandler(BaseHandler):
             self.set_status(425)
             self.write({"error": f"Invalid format: {str(e)}"})
         except Exception as e:
-            logger.error(f"Error updating reservation: {str(e)}")
+            logger.error("Error updating reservation: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
 
 class BulkReservationHandler(BaseHandler):
+    async def post(self):
+        """Create multiple reservations"""
+        try:
+            data = load_json(self.request.body)
+
+            if (
+                'reservations' not in data or
+                not isinstance(data['reservations'], list)
+            ):
+                self.set_status(435)
+                self.write({"error": "reservations must be a list"})
+                return
+
+            if not data['reservations']:
+                self.set_status(436)
+                self.write({"error": "reservations cannot be empty"})
+                return
+
+            # Validate and convert every pair up front
+            pairs = []
+            for item in data['reservations']:
+                if (
+                    not isinstance(item, dict) or
+                    'user_id' not in item or
+                    'book_id' not in item
+                ):
+                    self.set_status(437)
+                    self.write({
+                        "error": (
+                            "Each reservation needs a user_id and a book_id"
+                        )
+                    })
+                    return
+                try:
+                    pairs.append(
+                        (parse_uuid(item['user_id']),
+                         parse_uuid(item['book_id']))
+                    )
+                except ValueError:
+                    self.set_status(438)
+                    self.write({
+                        "error": f"Invalid UUID format in reservation: {item}"
+                    })
+                    return
+
+            if len(pairs) > LARGE_BULK_SIZE:
+                logger.warning("Bulk creation of %d reservations", len(pairs))
+
+            # Every pair goes through the same checks and conditional claim
+            # as a single reservation. A book can only be checked out once,
+            # and concurrent attempts could all see it available, so the
+            # pairs for each book are tried one after another until one of
+            # them gets it
+            pairs_by_book = {}
+            for index, (_, book_id) in enumerate(pairs):
+                pairs_by_book.setdefault(book_id, []).append(index)
+            results = await gather_bounded(
+                (
+                    self._reserve_book(pairs, indices)
+                    for indices in pairs_by_book.values()
+                ),
+                BULK_CONCURRENCY
+            )
+            outcomes = {}
+            for book_outcomes in results:
+                outcomes.update(book_outcomes)
+
+            reservations = []
+            failed = []
+            for index, (user_id, book_id) in enumerate(pairs):
+                status, body = outcomes[index]
+                if status == 201:
+                    reservations.append(body)
+                else:
+                    failed.append({
+                        "user_id": user_id,
+                        "book_id": book_id,
+                        "status_code": status,
+                        "error": body["error"]
+                    })
+
+            self.set_status(201 if reservations else 200)
+            self.write({
+                "reservations": reservations,
+                "failed": failed,
+                "created_count": len(reservations),
+                "total_requested": len(pairs)
+            })
+            if reservations:
+                mark_write_activity()
+
+        except json.JSONDecodeError:
+            self.set_status(439)
+            self.write({"error": "Invalid JSON"})
+        except Exception as e:
+            logger.error("Error creating reservations: %s", e)
+            self.set_status(500)
+            self.write({"error": "Internal server error"})
+
+    async def _reserve_book(self, pairs, indices):
+        """Try the pairs at indices, all for one book, until one succeeds
+
+        Returns the outcome of each pair by its index. Pairs after the one
+        that got the book are not tried, as the book is checked out by then.
+        """
+        outcomes = {}
+        reserved = False
+        for index in indices:
+            if reserved:
+                outcomes[index] = (
+                    416, {"error": "Book is not available for reservation"}
+                )
+                continue
+            try:
+                outcomes[index] = await create_reservation(*pairs[index])
+            except Exception as e:
+                # Other pairs may already be created, so report this one
+                # as failed rather than failing the whole request
+                logger.error("Error creating reservation: %s", e)
+                outcomes[index] = (500, {"error": "Internal server error"})
+            reserved = outcomes[index][0] == 201
+        return outcomes
+
     async def delete(self):
         """Cancel multiple reservations"""
         try:
-            data = json.loads(self.request.body)
+            data = load_json(self.request.body)
 
             if (
                 'reservation_ids' not in data or
@@ -406,11 +703,11 @@ class BulkReservationHandler(BaseHandler):
                 self.write({"error": "reservation_ids cannot be empty"})
                 return
 
-            # Convert to UUIDs and validate
+            # Validate and convert every ID up front
             reservation_uuids = []
             for res_id in data['reservation_ids']:
                 try:
-                    reservation_uuids.append(uuid.UUID(res_id))
+                    reservation_uuids.append(parse_uuid(res_id))
                 except ValueError:
                     self.set_status(428)
                     self.write({
@@ -420,75 +717,69 @@ class BulkReservationHandler(BaseHandler):
                     })
                     return
 
-            # Fetch all reservations to cancel
-            reservations_to_cancel = []
-            for res_uuid in reservation_uuids:
-                single_query = (
-                    "SELECT * FROM reservations "
-                    "WHERE reservation_id = %s"
+            concurrency_arg = self.get_argument(
+                "concurrency", str(BULK_CONCURRENCY)
+            )
+            if not concurrency_arg.isdigit() or int(concurrency_arg) < 1:
+                self.set_status(430)
+                self.write({
+                    "error": "concurrency must be a positive integer"
+                })
+                return
+            concurrency = min(int(concurrency_arg), MAX_BULK_CONCURRENCY)
+
+            if len(reservation_uuids) > LARGE_BULK_SIZE:
+                logger.warning(
+                    "Bulk cancel of %d reservations with concurrency %d",
+                    len(reservation_uuids), concurrency
                 )
-                result = await execute_async(single_query, (res_uuid,))
-                if result:
-                    reservations_to_cancel.extend(result)
+
+            # Fetch all reservations to cancel, one partition per query,
+            # with the lookups running concurrently. Repeated IDs are only
+            # fetched, and therefore cancelled, once
+            select_reservation = get_prepared(SELECT_RESERVATION_KEYS)
+            results = await gather_bounded(
+                (
+                    execute_async(select_reservation, (res_uuid,))
+                    for res_uuid in dict.fromkeys(reservation_uuids)
+                ),
+                concurrency
+            )
+            reservations_to_cancel = [
+                reservation for result in results for reservation in result
+            ]
 
             if not reservations_to_cancel:
                 self.set_status(404)
                 self.write({"error": "No reservations found"})
                 return
 
-            # Cancel each reservation
-            cancelled_count = 0
-            now = datetime.utcnow()
-
-            for reservation in reservations_to_cancel:
-                if reservation.status == 'active':
-                    # Update main reservation
-                    update_main = (
-                        "UPDATE reservations SET status = 'completed', "
-                        "updated_at = %s WHERE reservation_id = %s"
-                    )
-                    await execute_async(
-                        update_main,
-                        (now, reservation.reservation_id)
-                    )
-
-                    # Update denormalized tables
-                    update_by_user = (
-                        "UPDATE reservations_by_user SET status = 'completed' "
-                        "WHERE user_id = %s AND reservation_id = %s"
-                    )
-                    await execute_async(
-                        update_by_user,
-                        (reservation.user_id, reservation.reservation_id)
-                    )
-
-                    update_by_book = (
-                        "UPDATE reservations_by_book SET status = 'completed' "
-                        "WHERE book_id = %s AND reservation_id = %s"
-                    )
-                    await execute_async(
-                        update_by_book,
-                        (reservation.book_id, reservation.reservation_id)
-                    )
-
-                    # Remove from active reservations table
-                    delete_active = (
-                        "DELETE FROM reservations_user_book "
-                        "WHERE user_id = %s AND book_id = %s"
-                    )
-                    await execute_async(
-                        delete_active,
-                        (reservation.user_id, reservation.book_id)
-                    )
-
-                    # Make book available again
-                    update_book = (
-                        "UPDATE books SET status = 'available' "
-                        "WHERE book_id = %s"
-                    )
-                    await execute_async(update_book, (reservation.book_id,))
-
-                    cancelled_count += 1
+            # Cancel the active reservations concurrently
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            active_reservations = [
+                reservation for reservation in reservations_to_cancel
+                if reservation.status == 'active'
+            ]
+
+            # Several reservations may share a book, so free each book once
+            books_to_free = {
+                reservation.book_id for reservation in active_reservations
+            }
+            await gather_bounded(
+                (
+                    *(
+                        self._cancel_reservation(reservation, now)
+                        for reservation in active_reservations
+                    ),
+                    *(return_book(book_id) for book_id in books_to_free)
+                ),
+                concurrency
+            )
+            for reservation in active_reservations:
+                reservation_cache.invalidate(reservation.reservation_id)
+            if books_to_free:
+                invalidate_book_lists()
+            cancelled_count = len(active_reservations)
 
             self.write({
                 "message": (
@@ -503,6 +794,27 @@ class BulkReservationHandler(BaseHandler):
             self.set_status(429)
             self.write({"error": "Invalid JSON"})
         except Exception as e:
-            logger.error(f"Error cancelling reservations: {str(e)}")
+            logger.error("Error cancelling reservations: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
+
+    async def _cancel_reservation(self, reservation, now):
+        """Mark a reservation completed in every reservation table"""
+        # Update main reservation and the denormalized tables, remove it
+        # from the active reservations table and count it off its user.
+        # Each statement targets its own partition, so send them together
+        await asyncio.gather(
+            execute_async(
+                get_prepared(UPDATE_RESERVATION_QUERIES[('status',)]),
+                ('completed', now, reservation.reservation_id)
+            ),
+            execute_async(
+                get_prepared(UPDATE_BY_USER_STATUS),
+                ('completed', reservation.user_id, reservation.reservation_id)
+            ),
+            execute_async(
+                get_prepared(UPDATE_BY_BOOK_STATUS),
+                ('completed', reservation.book_id, reservation.reservation_id)
+            ),
+            release_active(reservation.user_id, reservation.book_id)
+        )
@@ -1,92 +1,283 @@
+import asyncio
 import json
 import uuid
-from datetime import datetime
-from handlers.base_handler import BaseHandler
-from db.cassandra import execute_async  # type: ignore
+from datetime import datetime, timezone
+from handlers.base_handler import BaseHandler, load_json, parse_uuid
+from db.cassandra import (  # type: ignore
+    execute_async,
+    execute_paged,
+    gather_bounded,
+    get_prepared,
+    resume_pages
+)
 import logging
+from cache import TTLCache
 from consistency_checker import mark_write_activity
 
 logger = logging.getLogger(__name__)
 
+# Whole book and user list responses are cached briefly, since they are
+# read far more often than they change. Writes made through the handlers
+# invalidate them, and anything else is picked up once the entry expires
+list_cache = TTLCache(ttl=2.0, maxsize=16)
+BOOK_LIST_KEY = "books"
+AVAILABLE_BOOK_LIST_KEY = "books:available"
+USER_LIST_KEY = "users"
+
+# Users whose reservations a bulk read fetches at once
+BULK_READ_CONCURRENCY = 64
+
+SELECT_USER_RESERVATIONS = """
+    SELECT reservation_id, book_id, book_title, status,
+           reservation_date, return_deadline
+    FROM reservations_by_user
+    WHERE user_id = ?
+"""
+SELECT_BOOK_RESERVATIONS = """
+    SELECT reservation_id, user_id, user_name, status,
+           reservation_date, return_deadline
+    FROM reservations_by_book
+    WHERE book_id = ?
+"""
+SELECT_ACTIVE_RESERVATIONS = """
+    SELECT book_id, reservation_id, book_title, reservation_date,
+           return_deadline, created_at
+    FROM reservations_user_book
+    WHERE user_id = ?
+"""
+# Kept up to date by the reservation handlers, so reading the count is a
+# single cell lookup instead of counting the user's active reservations
+SELECT_ACTIVE_COUNT = (
+    "SELECT active_count FROM user_counters WHERE user_id = ?"
+)
+
+SELECT_BOOK = (
+    "SELECT book_id, title, status, created_at FROM books WHERE book_id = ?"
+)
+SELECT_BOOK_STATUS = (
+    "SELECT book_id, title, status FROM books WHERE book_id = ?"
+)
+SELECT_ALL_BOOKS = "SELECT book_id, title, status, created_at FROM books"
+# books_by_status holds one partition per status, so listing the available
+# books reads a single partition instead of scanning books
+SELECT_BOOKS_BY_STATUS = (
+    "SELECT book_id, title, status, created_at FROM books_by_status "
+    "WHERE status = ?"
+)
+INSERT_BOOK = (
+    "INSERT INTO books (book_id, title, status, created_at) "
+    "VALUES (?, ?, ?, ?)"
+)
+INSERT_BOOK_BY_STATUS = (
+    "INSERT INTO books_by_status (status, book_id, title, created_at) "
+    "VALUES (?, ?, ?, ?)"
+)
+
+SELECT_USER = (
+    "SELECT user_id, username, created_at FROM users WHERE user_id = ?"
+)
+SELECT_USERNAME = "SELECT username FROM users WHERE user_id = ?"
+SELECT_ALL_USERS = "SELECT user_id, username, created_at FROM users"
+INSERT_USER = (
+    "INSERT INTO users (user_id, username, created_at) VALUES (?, ?, ?)"
+)
+
+# Every statement above, prepared once at startup
+STATEMENTS = (
+    SELECT_USER_RESERVATIONS,
+    SELECT_BOOK_RESERVATIONS,
+    SELECT_ACTIVE_RESERVATIONS,
+    SELECT_ACTIVE_COUNT,
+    SELECT_BOOK,
+    SELECT_BOOK_STATUS,
+    SELECT_ALL_BOOKS,
+    SELECT_BOOKS_BY_STATUS,
+    INSERT_BOOK,
+    INSERT_BOOK_BY_STATUS,
+    SELECT_USER,
+    SELECT_USERNAME,
+    SELECT_ALL_USERS,
+    INSERT_USER,
+)
+
+
+def user_reservation_entry(row):
+    """List entry for a reservations_by_user row"""
+    return {
+        "reservation_id": row.reservation_id,
+        "book_id": row.book_id,
+        "book_title": row.book_title,
+        "status": row.status,
+        "reservation_date": row.reservation_date,
+        "return_deadline": row.return_deadline
+    }
+
+
+def book_reservation_entry(row):
+    """List entry for a reservations_by_book row"""
+    return {
+        "reservation_id": row.reservation_id,
+        "user_id": row.user_id,
+        "user_name": row.user_name,
+        "status": row.status,
+        "reservation_date": row.reservation_date,
+        "return_deadline": row.return_deadline
+    }
+
+
+def active_reservation_entry(row):
+    """List entry for a reservations_user_book row"""
+    return {
+        "reservation_id": row.reservation_id,
+        "book_id": row.book_id,
+        "book_title": row.book_title,
+        "reservation_date": row.reservation_date,
+        "return_deadline": row.return_deadline,
+        "created_at": row.created_at
+    }
+
+
+def book_entry(book):
+    """Response body for a books or books_by_status row"""
+    return {
+        "book_id": book.book_id,
+        "title": book.title,
+        "status": book.status,
+        "created_at": book.created_at
+    }
+
+
+def user_entry(user):
+    """List entry for a users row"""
+    return {
+        "user_id": user.user_id,
+        "username": user.username,
+        "created_at": user.created_at
+    }
+
+
+def invalidate_book_lists():
+    """Drop the cached book lists after a book is added or changes status"""
+    for key in (BOOK_LIST_KEY, AVAILABLE_BOOK_LIST_KEY):
+        list_cache.invalidate(key)
+
 
 class UserReservationsHandler(BaseHandler):
     async def get(self, user_id):
         """Get all reservations for a user (active + completed)"""
         try:
-            user_uuid = uuid.UUID(user_id)
-
-            # Get reservations from reservations_by_user table
-            query = """
-                SELECT reservation_id, book_id, book_title, status,
-                       reservation_date, return_deadline
-                FROM reservations_by_user
-                WHERE user_id = %s
-            """
-            result = await execute_async(query, (user_uuid,))
-
-            reservations = []
-            for row in result:
-                reservations.append({
-                    "reservation_id": str(row.reservation_id),
-                    "book_id": str(row.book_id),
-                    "book_title": row.book_title,
-                    "status": row.status,
-                    "reservation_date": row.reservation_date.isoformat(),
-                    "return_deadline": row.return_deadline.isoformat()
-                })
-
-            self.write({
-                "user_id": str(user_uuid),
-                "reservations": reservations,
-                "total_count": len(reservations)
-            })
+            user_uuid = parse_uuid(user_id)
+
+            # Stream reservations from reservations_by_user table
+            await self.write_list(
+                {"user_id": user_uuid},
+                "reservations",
+                execute_paged(
+                    get_prepared(SELECT_USER_RESERVATIONS), (user_uuid,)
+                ),
+                user_reservation_entry,
+                "total_count"
+            )
 
         except ValueError:
             self.set_status(405)
             self.write({"error": "Invalid user ID format"})
         except Exception as e:
-            logger.error(f"Error fetching user reservations: {str(e)}")
+            logger.error("Error fetching user reservations: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
 
-class BookReservationsHandler(BaseHandler):
-    async def get(self, book_id):
-        """Get all reservations for a book (active + completed)"""
+class BulkUserReservationsHandler(BaseHandler):
+    async def post(self):
+        """Get all reservations for several users in one request"""
         try:
-            book_uuid = uuid.UUID(book_id)
-
-            # Get reservations from reservations_by_book table
-            query = """
-                SELECT reservation_id, user_id, user_name, status,
-                       reservation_date, return_deadline
-                FROM reservations_by_book
-                WHERE book_id = %s
-            """
-            result = await execute_async(query, (book_uuid,))
-
-            reservations = []
-            for row in result:
-                reservations.append({
-                    "reservation_id": str(row.reservation_id),
-                    "user_id": str(row.user_id),
-                    "user_name": row.user_name,
-                    "status": row.status,
-                    "reservation_date": row.reservation_date.isoformat(),
-                    "return_deadline": row.return_deadline.isoformat()
-                })
+            data = load_json(self.request.body)
+
+            if (
+                'user_ids' not in data or
+                not isinstance(data['user_ids'], list)
+            ):
+                self.set_status(431)
+                self.write({"error": "user_ids must be a list"})
+                return
+
+            if not data['user_ids']:
+                self.set_status(432)
+                self.write({"error": "user_ids cannot be empty"})
+                return
+
+            user_uuids = []
+            for user_id in data['user_ids']:
+                try:
+                    user_uuids.append(parse_uuid(user_id))
+                except ValueError:
+                    self.set_status(433)
+                    self.write({
+                        "error": f"Invalid user ID format: {user_id}"
+                    })
+                    return
+
+            # One reservations_by_user partition per user, read
+            # concurrently. Repeated IDs are only read once
+            user_uuids = list(dict.fromkeys(user_uuids))
+            results = await gather_bounded(
+                (
+                    self._user_reservations(user_uuid)
+                    for user_uuid in user_uuids
+                ),
+                BULK_READ_CONCURRENCY
+            )
 
             self.write({
-                "book_id": str(book_uuid),
-                "reservations": reservations,
-                "total_count": len(reservations)
+                "reservations": {
+                    str(user_uuid): reservations
+                    for user_uuid, reservations in zip(user_uuids, results)
+                },
+                "user_count": len(user_uuids),
+                "total_count": sum(map(len, results))
             })
 
+        except json.JSONDecodeError:
+            self.set_status(434)
+            self.write({"error": "Invalid JSON"})
+        except Exception as e:
+            logger.error("Error fetching bulk user reservations: %s", e)
+            self.set_status(500)
+            self.write({"error": "Internal server error"})
+
+    async def _user_reservations(self, user_uuid):
+        """Every reservation of one user as list entries"""
+        reservations = []
+        async for rows, _ in execute_paged(
+            get_prepared(SELECT_USER_RESERVATIONS), (user_uuid,)
+        ):
+            reservations.extend(map(user_reservation_entry, rows))
+        return reservations
+
+
+class BookReservationsHandler(BaseHandler):
+    async def get(self, book_id):
+        """Get all reservations for a book (active + completed)"""
+        try:
+            book_uuid = parse_uuid(book_id)
+
+            # Stream reservations from reservations_by_book table
+            await self.write_list(
+                {"book_id": book_uuid},
+                "reservations",
+                execute_paged(
+                    get_prepared(SELECT_BOOK_RESERVATIONS), (book_uuid,)
+                ),
+                book_reservation_entry,
+                "total_count"
+            )
+
         except ValueError:
             self.set_status(406)
             self.write({"error": "Invalid book ID format"})
         except Exception as e:
-            logger.error(f"Error fetching book reservations: {str(e)}")
+            logger.error("Error fetching book reservations: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
@@ -97,59 +288,57 @@ class BookHandler(BaseHandler):
         try:
             if book_id:
                 # Get specific book
-                book_uuid = uuid.UUID(book_id)
-                query = "SELECT * FROM books WHERE book_id = %s"
-                result = await execute_async(query, (book_uuid,))
+                book_uuid = parse_uuid(book_id)
+                result = await execute_async(
+                    get_prepared(SELECT_BOOK), (book_uuid,)
+                )
 
                 if not result:
                     self.set_status(404)
                     self.write({"error": "Book not found"})
                     return
 
-                book = result[0]
-                self.write({
-                    "book_id": str(book.book_id),
-                    "title": book.title,
-                    "status": book.status,
-                    "created_at": book.created_at.isoformat()
-                })
+                self.write(book_entry(result[0]))
             else:
                 # List all books
                 available_arg = self.get_argument("available", "false")
                 available_only = available_arg.lower() == "true"
 
-                query = "SELECT * FROM books"
-                result = await execute_async(query)
-
-                books = []
-                for book in result:
-                    books.append({
-                        "book_id": str(book.book_id),
-                        "title": book.title,
-                        "status": book.status,
-                        "created_at": book.created_at.isoformat()
-                    })
-
-                self.write({
-                    "books": books,
-                    "total_count": len(books),
-                    "filter_applied": (
-                        "available_only" if available_only else "none"
+                if available_only:
+                    pages = execute_paged(
+                        get_prepared(SELECT_BOOKS_BY_STATUS), ('available',)
                     )
-                })
+                    cache_key = AVAILABLE_BOOK_LIST_KEY
+                else:
+                    pages = execute_paged(get_prepared(SELECT_ALL_BOOKS))
+                    cache_key = BOOK_LIST_KEY
+
+                await self.write_list(
+                    {
+                        "filter_applied": (
+                            "available_only" if available_only else "none"
+                        )
+                    },
+                    "books",
+                    pages,
+                    book_entry,
+                    "total_count",
+                    list_cache,
+                    cache_key
+                )
 
         except ValueError:
             self.set_status(407)
             self.write({"error": "Invalid book ID format"})
         except Exception as e:
-            logger.error(f"Error fetching books: {str(e)}")
+            logger.error("Error fetching books: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
     async def post(self):
         """Create a new book"""
         try:
-            data = json.loads(self.request.body)
+            data = load_json(self.request.body)
 
             # Validate required fields
             if 'title' not in data:
@@ -158,32 +347,35 @@ class BookHandler(BaseHandler):
                 return
 
             book_id = uuid.uuid4()
-            now = datetime.utcnow()
-
-            # Insert book
-            query = """
-                INSERT INTO books (book_id, title, status, created_at)
-                VALUES (%s, %s, %s, %s)
-            """
-            await execute_async(
-                query,
-                (book_id, data['title'], 'available', now)
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+            # Insert book and list it as available
+            await asyncio.gather(
+                execute_async(
+                    get_prepared(INSERT_BOOK),
+                    (book_id, data['title'], 'available', now)
+                ),
+                execute_async(
+                    get_prepared(INSERT_BOOK_BY_STATUS),
+                    ('available', book_id, data['title'], now)
+                )
             )
 
             self.set_status(201)
             self.write({
-                "book_id": str(book_id),
+                "book_id": book_id,
                 "title": data['title'],
                 "status": "available",
-                "created_at": now.isoformat()
+                "created_at": now
             })
+            invalidate_book_lists()
             mark_write_activity()
 
         except json.JSONDecodeError:
             self.set_status(409)
             self.write({"error": "Invalid JSON"})
         except Exception as e:
-            logger.error(f"Error creating book: {str(e)}")
+            logger.error("Error creating book: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
@@ -194,14 +386,12 @@ class BookAvailabilityHandler(BaseHandler):
         Check if a book is available (fast O(1) lookup using book status)
         """
         try:
-            book_uuid = uuid.UUID(book_id)
+            book_uuid = parse_uuid(book_id)
 
             # Check book status directly - this is O(1) and efficient
-            book_query = (
-                "SELECT book_id, title, status "
-                "FROM books WHERE book_id = %s"
+            book_result = await execute_async(
+                get_prepared(SELECT_BOOK_STATUS), (book_uuid,)
             )
-            book_result = await execute_async(book_query, (book_uuid,))
             if not book_result:
                 self.set_status(404)
                 self.write({"error": "Book not found"})
@@ -211,7 +401,7 @@ class BookAvailabilityHandler(BaseHandler):
             is_available = book.status == 'available'
 
             self.write({
-                "book_id": str(book_uuid),
+                "book_id": book_uuid,
                 "title": book.title,
                 "available": is_available,
                 "status": book.status
@@ -221,7 +411,7 @@ class BookAvailabilityHandler(BaseHandler):
             self.set_status(410)
             self.write({"error": "Invalid book ID format"})
         except Exception as e:
-            logger.error(f"Error checking book availability: {str(e)}")
+            logger.error("Error checking book availability: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
@@ -233,48 +423,53 @@ class ActiveReservationsHandler(BaseHandler):
         (fast O(1) lookup using reservations_user_book)
         """
         try:
-            user_uuid = uuid.UUID(user_id)
+            user_uuid = parse_uuid(user_id)
 
-            # Check if user exists
-            user_query = "SELECT username FROM users WHERE user_id = %s"
-            user_result = await execute_async(user_query, (user_uuid,))
-            if not user_result:
-                self.set_status(404)
-                self.write({"error": "User not found"})
-                return
+            # Check if user exists while the first page of active
+            # reservations is read from reservations_user_book
+            pages = execute_paged(
+                get_prepared(SELECT_ACTIVE_RESERVATIONS), (user_uuid,)
+            )
+            try:
+                # Both reads are awaited even if one fails, so the pages are
+                # not still being read when they are closed below
+                user_result, first_page = await asyncio.gather(
+                    execute_async(
+                        get_prepared(SELECT_USERNAME), (user_uuid,)
+                    ),
+                    anext(pages),
+                    return_exceptions=True
+                )
+                for result in (user_result, first_page):
+                    if isinstance(result, BaseException):
+                        raise result
 
-            # Get active reservations from reservations_user_book table
-            query = """
-                SELECT book_id, reservation_id, book_title, reservation_date,
-                       return_deadline, created_at
-                FROM reservations_user_book
-                WHERE user_id = %s
-            """
-            result = await execute_async(query, (user_uuid,))
-
-            active_reservations = []
-            for row in result:
-                active_reservations.append({
-                    "reservation_id": str(row.reservation_id),
-                    "book_id": str(row.book_id),
-                    "book_title": row.book_title,
-                    "reservation_date": row.reservation_date.isoformat(),
-                    "return_deadline": row.return_deadline.isoformat(),
-                    "created_at": row.created_at.isoformat()
-                })
+                if not user_result:
+                    self.set_status(404)
+                    self.write({"error": "User not found"})
+                    return
 
-            self.write({
-                "user_id": str(user_uuid),
-                "username": user_result[0].username,
-                "active_reservations": active_reservations,
-                "active_count": len(active_reservations)
-            })
+                # Stream the active reservations
+                await self.write_list(
+                    {
+                        "user_id": user_uuid,
+                        "username": user_result[0].username
+                    },
+                    "active_reservations",
+                    resume_pages(first_page, pages),
+                    active_reservation_entry,
+                    "active_count"
+                )
+            finally:
+                # Finish the pages now, on every path, instead of whenever
+                # the generator is garbage collected
+                await pages.aclose()
 
         except ValueError:
             self.set_status(411)
             self.write({"error": "Invalid user ID format"})
         except Exception as e:
-            logger.error(f"Error fetching active reservations: {str(e)}")
+            logger.error("Error fetching active reservations: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
@@ -285,9 +480,15 @@ class UserHandler(BaseHandler):
         try:
             if user_id:
                 # Get specific user
-                user_uuid = uuid.UUID(user_id)
-                query = "SELECT * FROM users WHERE user_id = %s"
-                result = await execute_async(query, (user_uuid,))
+                user_uuid = parse_uuid(user_id)
+
+                # Get the user and their active reservations count together
+                result, active_result = await asyncio.gather(
+                    execute_async(get_prepared(SELECT_USER), (user_uuid,)),
+                    execute_async(
+                        get_prepared(SELECT_ACTIVE_COUNT), (user_uuid,)
+                    )
+                )
 
                 if not result:
                     self.set_status(404)
@@ -295,51 +496,40 @@ class UserHandler(BaseHandler):
                     return
 
                 user = result[0]
-
-                # Also get active reservations count for this user
-                active_query = (
-                    "SELECT COUNT(*) FROM reservations_user_book "
-                    "WHERE user_id = %s"
+                active_count = (
+                    active_result[0].active_count if active_result else 0
                 )
-                active_result = await execute_async(active_query, (user_uuid,))
-                active_count = active_result[0].count if active_result else 0
 
                 self.write({
-                    "user_id": str(user.user_id),
+                    "user_id": user.user_id,
                     "username": user.username,
-                    "created_at": user.created_at.isoformat(),
+                    "created_at": user.created_at,
                     "active_reservations_count": active_count
                 })
             else:
                 # List all users
-                query = "SELECT * FROM users"
-                result = await execute_async(query)
-
-                users = []
-                for user in result:
-                    users.append({
-                        "user_id": str(user.user_id),
-                        "username": user.username,
-                        "created_at": user.created_at.isoformat()
-                    })
-
-                self.write({
-                    "users": users,
-                    "total_count": len(users)
-                })
+                await self.write_list(
+                    {},
+                    "users",
+                    execute_paged(get_prepared(SELECT_ALL_USERS)),
+                    user_entry,
+                    "total_count",
+                    list_cache,
+                    USER_LIST_KEY
+                )
 
         except ValueError:
             self.set_status(412)
             self.write({"error": "Invalid user ID format"})
         except Exception as e:
-            logger.error(f"Error fetching users: {str(e)}")
+            logger.error("Error fetching users: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
 
     async def post(self):
         """Create a new user"""
         try:
-            data = json.loads(self.request.body)
+            data = load_json(self.request.body)
 
             # Validate required fields
             if 'username' not in data:
@@ -348,27 +538,26 @@ class UserHandler(BaseHandler):
                 return
 
             user_id = uuid.uuid4()
-            now = datetime.utcnow()
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
 
             # Insert user
-            query = """
-                INSERT INTO users (user_id, username, created_at)
-                VALUES (%s, %s, %s)
-            """
-            await execute_async(query, (user_id, data['username'], now))
+            await execute_async(
+                get_prepared(INSERT_USER), (user_id, data['username'], now)
+            )
 
             self.set_status(201)
             self.write({
-                "user_id": str(user_id),
+                "user_id": user_id,
                 "username": data['username'],
-                "created_at": now.isoformat()
+                "created_at": now
             })
+            list_cache.invalidate(USER_LIST_KEY)
             mark_write_activity()
 
         except json.JSONDecodeError:
             self.set_status(414)
             self.write({"error": "Invalid JSON"})
         except Exception as e:
-            logger.error(f"Error creating user: {str(e)}")
+            logger.error("Error creating user: %s", e)
             self.set_status(500)
             self.write({"error": "Internal server error"})
@@ -5,28 +5,41 @@ import tornado.platform.asyncio
 import logging
 import sys
 from consistency_checker import (
+  STATEMENTS as CONSISTENCY_STATEMENTS,
   start_consistency_checker,
   stop_consistency_checker
 )
 
 from handlers.reservation_handler import (
+    STATEMENTS as RESERVATION_STATEMENTS,
     ReservationHandler,
     ReservationDetailHandler,
     BulkReservationHandler
 )
 from handlers.user_book_handler import (
+    STATEMENTS as USER_BOOK_STATEMENTS,
     UserReservationsHandler,
+    BulkUserReservationsHandler,
     BookReservationsHandler,
     BookHandler,
     UserHandler,
     ActiveReservationsHandler
 )
-from db.cassandra import init_cassandra, close_cassandra
+from db.cassandra import init_cassandra, close_cassandra, prepare_statements
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 sys.stdout.reconfigure(encoding='utf-8', line_buffering=True)
 
 PORT = int(os.environ.get("PORT", 8000))
 
+# Debug mode turns on autoreload and serves tracebacks, so it is only
+# enabled on request
+DEBUG = os.environ.get("TORNADO_DEBUG", "0") == "1"
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -41,6 +54,7 @@ def make_app() -> tornado.web.Application:
         (r"/api/reservations/bulk", BulkReservationHandler),
         (r"/api/reservations/([^/]+)", ReservationDetailHandler),
         (r"/api/reservations/user/([^/]+)", UserReservationsHandler),
+        (r"/api/reservations/users/bulk", BulkUserReservationsHandler),
         (r"/api/reservations/book/([^/]+)", BookReservationsHandler),
 
         # Book endpoints
@@ -52,12 +66,17 @@ def make_app() -> tornado.web.Application:
         (r"/api/users/([^/]+)", UserHandler),
         (r"/api/users/([^/]+)/active-reservations", ActiveReservationsHandler),
 
-    ], debug=True)
+    ], debug=DEBUG)
 
 
 async def main():
     try:
         await init_cassandra()
+        prepare_statements((
+            *RESERVATION_STATEMENTS,
+            *USER_BOOK_STATEMENTS,
+            *CONSISTENCY_STATEMENTS
+        ))
 
         await start_consistency_checker()
 
@@ -79,7 +98,12 @@ async def main():
             "  GET    /api/reservations/book/{book_id} - "
             "Get book's ALL reservations"
         )
+        print("  POST   /api/reservations/bulk - Create multiple reservations")
         print("  DELETE /api/reservations/bulk - Cancel multiple reservations")
+        print(
+            "  POST   /api/reservations/users/bulk - "
+            "Get ALL reservations of several users"
+        )
 
         print("\n📖 BOOK ENDPOINTS:")
         print(
@@ -135,6 +159,10 @@ async def main():
 
 if __name__ == "__main__":
     try:
+        if uvloop is not None:
+            # libuv-based loop with cheaper callbacks and awaits. It is
+            # optional, as it is not available on Windows
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         tornado.platform.asyncio.AsyncIOMainLoop().install()
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -8,16 +8,119 @@ Usage: python create_sample_data.py
 """
 
 import asyncio
+import json
+
 import aiohttp
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 API_BASE = "http://localhost:8000/api"
 
+# Requests in flight at once, so the server is not flooded
+MAX_CONCURRENT_REQUESTS = 20
+
+
+def dump_json(obj):
+    """Encode a request body, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+async def read_json(resp):
+    """Decode a response body, using orjson when it is installed"""
+    body = await resp.read()
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+async def create_user(session, limit, user_data):
+    """Create one user, returning its ID or None if that failed"""
+    async with limit:
+        try:
+            async with session.post(
+                f"{API_BASE}/users",
+                json=user_data,
+                headers={"Content-Type": "application/json"}
+            ) as resp:
+                if resp.status == 201:
+                    result = await read_json(resp)
+                    print(
+                        f"✓ Created user: {user_data['username']} "
+                        f"(ID: {result['user_id']})"
+                    )
+                    return result['user_id']
+                error = await read_json(resp)
+                print(
+                    "✗ Failed to create user "
+                    f"{user_data['username']}: {error}"
+                )
+        except Exception as e:
+            print(f"✗ Error creating user {user_data['username']}: {e}")
+    return None
+
+
+async def create_book(session, limit, book_data):
+    """Create one book, returning its ID or None if that failed"""
+    async with limit:
+        try:
+            async with session.post(
+                f"{API_BASE}/books",
+                json=book_data,
+                headers={"Content-Type": "application/json"}
+            ) as resp:
+                if resp.status == 201:
+                    result = await read_json(resp)
+                    print(
+                        f"✓ Created book: {book_data['title']} "
+                        f"(ID: {result['book_id']})"
+                    )
+                    return result['book_id']
+                error = await read_json(resp)
+                print(
+                    "✗ Failed to create book "
+                    f"{book_data['title']}: {error}"
+                )
+        except Exception as e:
+            print(f"✗ Error creating book {book_data['title']}: {e}")
+    return None
+
+
+async def create_reservation(session, limit, reservation_data):
+    """Create one reservation, returning its ID or None if that failed"""
+    async with limit:
+        try:
+            async with session.post(
+                f"{API_BASE}/reservations",
+                json=reservation_data,
+                headers={"Content-Type": "application/json"}
+            ) as resp:
+                if resp.status == 201:
+                    result = await read_json(resp)
+                    print(
+                        "✓ Created reservation: "
+                        f"{result['user_name']} "
+                        f"reserved {result['book_title']} "
+                        f"(ID: {result['reservation_id']})"
+                    )
+                    return result['reservation_id']
+                error = await read_json(resp)
+                print(f"✗ Failed to create reservation: {error}")
+        except Exception as e:
+            print(f"✗ Error creating reservation: {e}")
+    return None
+
 
 async def create_sample_data():
     """Create sample users and books for testing"""
 
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(json_serialize=dump_json) as session:
         print("Creating sample data...")
+        limit = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
         # Sample users
         users = [
@@ -28,31 +131,6 @@ async def create_sample_data():
             {"username": "emma_davis"}
         ]
 
-        user_ids = []
-        print("\nCreating users...")
-        for user_data in users:
-            try:
-                async with session.post(
-                    f"{API_BASE}/users",
-                    json=user_data,
-                    headers={"Content-Type": "application/json"}
-                ) as resp:
-                    if resp.status == 201:
-                        result = await resp.json()
-                        user_ids.append(result['user_id'])
-                        print(
-                            f"✓ Created user: {user_data['username']} "
-                            f"(ID: {result['user_id']})"
-                        )
-                    else:
-                        error = await resp.json()
-                        print(
-                            "✗ Failed to create user "
-                            f"{user_data['username']}: {error}"
-                        )
-            except Exception as e:
-                print(f"✗ Error creating user {user_data['username']}: {e}")
-
         # Sample books
         books = [
             {"title": "The Great Gatsby"},
@@ -67,30 +145,19 @@ async def create_sample_data():
             {"title": "Fahrenheit 451"}
         ]
 
-        book_ids = []
-        print("\nCreating books...")
-        for book_data in books:
-            try:
-                async with session.post(
-                    f"{API_BASE}/books",
-                    json=book_data,
-                    headers={"Content-Type": "application/json"}
-                ) as resp:
-                    if resp.status == 201:
-                        result = await resp.json()
-                        book_ids.append(result['book_id'])
-                        print(
-                            f"✓ Created book: {book_data['title']} "
-                            f"(ID: {result['book_id']})"
-                        )
-                    else:
-                        error = await resp.json()
-                        print(
-                            "✗ Failed to create book "
-                            f"{book_data['title']}: {error}"
-                        )
-            except Exception as e:
-                print(f"✗ Error creating book {book_data['title']}: {e}")
+        # Users and books do not depend on each other, so they are all
+        # created at once
+        print("\nCreating users and books...")
+        created = await asyncio.gather(
+            *(create_user(session, limit, user) for user in users),
+            *(create_book(session, limit, book) for book in books)
+        )
+        user_ids = [
+            user_id for user_id in created[:len(users)] if user_id
+        ]
+        book_ids = [
+            book_id for book_id in created[len(users):] if book_id
+        ]
 
         # Create some sample reservations
         print("\nCreating sample reservations...")
@@ -102,28 +169,11 @@ async def create_sample_data():
                 {"user_id": user_ids[0], "book_id": book_ids[2]},
             ]
 
-            reservation_ids = []
-            for reservation_data in sample_reservations:
-                try:
-                    async with session.post(
-                        f"{API_BASE}/reservations",
-                        json=reservation_data,
-                        headers={"Content-Type": "application/json"}
-                    ) as resp:
-                        if resp.status == 201:
-                            result = await resp.json()
-                            reservation_ids.append(result['reservation_id'])
-                            print(
-                                "✓ Created reservation: "
-                                f"{result['user_name']} "
-                                f"reserved {result['book_title']} "
-                                f"(ID: {result['reservation_id']})"
-                            )
-                        else:
-                            error = await resp.json()
-                            print(f"✗ Failed to create reservation: {error}")
-                except Exception as e:
-                    print(f"✗ Error creating reservation: {e}")
+            # Each one is for a different book, so they cannot conflict
+            await asyncio.gather(*(
+                create_reservation(session, limit, reservation)
+                for reservation in sample_reservations
+            ))
 
         print("\n🎉 Sample data creation complete!")
         print(f"Created {len(user_ids)} users, {len(book_ids)} books")
@@ -142,12 +192,12 @@ async def test_api_endpoints():
     """Test some basic API endpoints to verify everything is working"""
     print("\n🔍 Testing API endpoints...")
 
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(json_serialize=dump_json) as session:
         # Test books list endpoint
         try:
             async with session.get(f"{API_BASE}/books") as resp:
                 if resp.status == 200:
-                    result = await resp.json()
+                    result = await read_json(resp)
                     print(
                         "✓ Books endpoint: "
                         f"Found {result['total_count']} books"
@@ -161,7 +211,7 @@ async def test_api_endpoints():
         try:
             async with session.get(f"{API_BASE}/books?available=true") as resp:
                 if resp.status == 200:
-                    result = await resp.json()
+                    result = await read_json(resp)
                     available_count = result['total_count']
                     print(
                         "✓ Available books endpoint: "
@@ -1,63 +1,119 @@
-import requests  # type: ignore
+import asyncio
+import sys
 import uuid
 
+import aiohttp
+
 API_BASE = "http://localhost:8000/api"
 
 NUM_USERS = 5
 NUM_BOOKS = 5
 
+# Connections open to the server at once. Requests beyond this wait for a
+# free kept-alive connection instead of opening more
+MAX_CONNECTIONS = 16
+
+
+async def check_server(session):
+    """Return whether the API server is accepting requests"""
+    # There is no health endpoint, but any HTTP response at all shows the
+    # server is up. This fails once instead of on every POST below
+    try:
+        async with session.get(
+            API_BASE, timeout=aiohttp.ClientTimeout(total=2)
+        ):
+            pass
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"❌ Cannot reach the API at {API_BASE}: {e}")
+        return False
+    return True
 
-def create_users():
-    users = []
-    for i in range(NUM_USERS):
-        username = f"user_{i+1}_{uuid.uuid4().hex[:6]}"
-        res = requests.post(f"{API_BASE}/users", json={"username": username})
-        if res.status_code == 201:
-            user = res.json()
+
+async def create_user(session, i):
+    username = f"user_{i+1}_{uuid.uuid4().hex[:6]}"
+    async with session.post(
+        f"{API_BASE}/users", json={"username": username}
+    ) as res:
+        if res.status == 201:
+            user = await res.json()
             print(f"✅ Created user: {user['username']} ({user['user_id']})")
-            users.append(user)
-        else:
-            print(f"❌ Failed to create user {username}: {res.text}")
-    return users
-
-
-def create_books():
-    books = []
-    for i in range(NUM_BOOKS):
-        title = f"Book {i+1} - {uuid.uuid4().hex[:5]}"
-        res = requests.post(f"{API_BASE}/books", json={"title": title})
-        if res.status_code in (200, 201):
-            book = res.json()
+            return user
+        print(f"❌ Failed to create user {username}: {await res.text()}")
+        return None
+
+
+async def create_book(session, i):
+    title = f"Book {i+1} - {uuid.uuid4().hex[:5]}"
+    async with session.post(
+        f"{API_BASE}/books", json={"title": title}
+    ) as res:
+        if res.status in (200, 201):
+            book = await res.json()
             print(f"📖 Created book: {book['title']} ({book['book_id']})")
-            books.append(book)
-        else:
-            print(f"❌ Failed to create book {title}: {res.text}")
-    return books
+            return book
+        print(f"❌ Failed to create book {title}: {await res.text()}")
+        return None
 
 
-def make_reservations(users, books):
+async def create_users_and_books(session):
+    # None of them depend on each other, so they are all created at once.
+    # gather() keeps them in order
+    created = await asyncio.gather(
+        *(create_user(session, i) for i in range(NUM_USERS)),
+        *(create_book(session, i) for i in range(NUM_BOOKS))
+    )
+    users = [user for user in created[:NUM_USERS] if user is not None]
+    books = [book for book in created[NUM_USERS:] if book is not None]
+    return users, books
+
+
+async def make_reservations(session, users, books):
     num = min(3, len(users), len(books))
-    for i in range(num):
-        user = users[i]
-        book = books[i]
-        payload = {
-            "user_id": user["user_id"],
-            "book_id": book["book_id"]
-        }
-        res = requests.post(f"{API_BASE}/reservations", json=payload)
-        if res.status_code == 201:
+    if not num:
+        return
+    pairs = list(zip(users[:num], books[:num]))
+
+    # Send every reservation in one request
+    payload = {
+        "reservations": [
+            {"user_id": user["user_id"], "book_id": book["book_id"]}
+            for user, book in pairs
+        ]
+    }
+    async with session.post(
+        f"{API_BASE}/reservations/bulk", json=payload
+    ) as res:
+        if res.status not in (200, 201):
+            print(f"⚠️ Failed to create reservations: {await res.text()}")
+            return
+        result = await res.json()
+
+    created = {
+        reservation["book_id"] for reservation in result["reservations"]
+    }
+    for user, book in pairs:
+        if book["book_id"] in created:
             print(
                 "📚 Reservation created: "
                 f"{user['username']} → {book['title']}"
             )
-        else:
-            print(f"⚠️ Failed to create reservation: {res.text}")
+    for failure in result["failed"]:
+        print(f"⚠️ Failed to create reservation: {failure['error']}")
+
+
+async def main():
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        if not await check_server(session):
+            return False
+        print("🔧 Creating sample users and books...\n")
+        users, books = await create_users_and_books(session)
+        print("\n🔁 Creating reservations for first 3 user-book pairs...\n")
+        await make_reservations(session, users, books)
+        print("\n✅ Sample data setup complete.")
+        return True
 
 
 if __name__ == "__main__":
-    print("🔧 Creating sample users and books...\n")
-    users = create_users()
-    books = create_books()
-    print("\n🔁 Creating reservations for first 3 user-book pairs...\n")
-    make_reservations(users, books)
-    print("\n✅ Sample data setup complete.")
+    if not asyncio.run(main()):
+        sys.exit(1)
@@ -9,10 +9,13 @@ Usage: python setup_database.py
 Make sure Cassandra is running before executing this script.
 """
 
-from cassandra.cluster import Cluster  # type: ignore
+from cassandra.cluster import (  # type: ignore
+    Cluster,
+    ExecutionProfile,
+    EXEC_PROFILE_DEFAULT
+)
 from cassandra.policies import DCAwareRoundRobinPolicy  # type: ignore
 import sys
-import time
 
 
 def create_keyspace_and_tables():
@@ -23,10 +26,16 @@ def create_keyspace_and_tables():
 
     try:
         print("Connecting to Cassandra cluster...")
+        # Configured through an execution profile like the app, since the
+        # legacy Cluster arguments cannot be combined with profiles
+        profile = ExecutionProfile(
+            load_balancing_policy=DCAwareRoundRobinPolicy(),
+            request_timeout=10.0
+        )
         cluster = Cluster(
             contact_points=[('127.0.0.1', 9042), ('127.0.0.1', 9043)],
             connect_timeout=10,
-            load_balancing_policy=DCAwareRoundRobinPolicy(),
+            execution_profiles={EXEC_PROFILE_DEFAULT: profile},
             protocol_version=5
         )
         session = cluster.connect()
@@ -39,12 +48,19 @@ def create_keyspace_and_tables():
     try:
         print("\nCreating keyspace 'data'...")
 
-        keyspace_query = """
+        # Replicas are placed per data center, matching the DC-aware load
+        # balancing policy. Use the data center of the node connected to
+        local_dc = session.execute(
+            "SELECT data_center FROM system.local"
+        ).one().data_center
+        print(f"✓ Local data center: {local_dc}")
+
+        keyspace_query = f"""
         CREATE KEYSPACE IF NOT EXISTS data
-        WITH REPLICATION = {
-            'class': 'SimpleStrategy',
-            'replication_factor': 2
-        }
+        WITH REPLICATION = {{
+            'class': 'NetworkTopologyStrategy',
+            '{local_dc}': 2
+        }}
         """
 
         session.execute(keyspace_query)
@@ -104,58 +120,90 @@ def create_keyspace_and_tables():
                 )
             """,
 
+            "books_by_status": """
+                CREATE TABLE IF NOT EXISTS books_by_status (
+                    status TEXT,
+                    book_id UUID,
+                    title TEXT,
+                    created_at TIMESTAMP,
+                    PRIMARY KEY (status, book_id)
+                )
+            """,
+
             "users": """
                 CREATE TABLE IF NOT EXISTS users (
                     user_id UUID PRIMARY KEY,
                     username TEXT,
                     created_at TIMESTAMP
                 )
+            """,
+
+            "user_counters": """
+                CREATE TABLE IF NOT EXISTS user_counters (
+                    user_id UUID PRIMARY KEY,
+                    active_count COUNTER
+                )
             """
         }
 
-        print("\nCreating tables...")
-        for table_name, table_query in tables.items():
-            try:
-                session.execute(table_query)
-                print(f"✓ Table '{table_name}' created successfully")
-                time.sleep(0.1)  # Small delay to avoid overwhelming Cassandra
-            except Exception as e:
-                print(f"✗ Failed to create table '{table_name}': {e}")
-                return False
-
-        # Verify tables were created
-        print("\nVerifying table creation...")
-
-        # Get list of tables in the keyspace
+        # Tables already in the keyspace need no DDL, so a re-run against
+        # a complete schema sends no CREATE at all
         tables_query = """
             SELECT table_name FROM system_schema.tables
             WHERE keyspace_name = 'data'
         """
-
-        result = session.execute(tables_query)
-        created_tables = [row.table_name for row in result]
-
-        expected_tables = [
-            'reservations',
-            'reservations_by_user',
-            'reservations_by_book',
-            'books',
-            'users'
+        existing_tables = {
+            row.table_name for row in session.execute(tables_query)
+        }
+        missing_tables = [
+            table_name for table_name in tables
+            if table_name not in existing_tables
         ]
 
-        print("Tables found in keyspace 'data':")
-        for table in created_tables:
-            status = "✓" if table in expected_tables else "?"
-            print(f"  {status} {table}")
-
-        missing_tables = set(expected_tables) - set(created_tables)
-        if missing_tables:
-            print(f"\n⚠️  Missing tables: {', '.join(missing_tables)}")
+        print("\nCreating tables...")
+        if not missing_tables:
+            print("✓ Schema already present; skipping DDL")
+
+        # The tables do not depend on each other, so send every CREATE at
+        # once. Each one still completes only after the cluster agrees on
+        # the new schema
+        futures = {
+            table_name: session.execute_async(tables[table_name])
+            for table_name in missing_tables
+        }
+        failed_tables = []
+        for table_name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"✗ Failed to create table '{table_name}': {e}")
+                failed_tables.append(table_name)
+
+        # A CREATE that succeeded has already been agreed on by the
+        # cluster, so the tables only need listing when one failed
+        if futures and not failed_tables:
+            print(
+                f"✓ {len(futures)}/{len(futures)} missing tables created"
+            )
+        elif failed_tables:
+            print("\nVerifying table creation...")
+
+            result = session.execute(tables_query)
+            created_tables = [row.table_name for row in result]
+
+            print("Tables found in keyspace 'data':")
+            for table in created_tables:
+                status = "✓" if table in tables else "?"
+                print(f"  {status} {table}")
+
+            missing_tables = set(tables) - set(created_tables)
+            if missing_tables:
+                print(f"\n⚠️  Missing tables: {', '.join(missing_tables)}")
             return False
 
         print("\n🎉 Database setup completed successfully!")
         print("Created keyspace: data")
-        print(f"Created tables: {len(expected_tables)}")
+        print(f"Tables: {len(tables)}")
 
         # Show some additional info
         print("\n📋 Keyspace Information:")
@@ -202,8 +250,8 @@ def show_connection_info():
     print("\n📡 Cassandra Connection Information:")
     print("  Trying to connect to: 127.0.0.1:9042, 127.0.0.1:9043")
     print("  Keyspace: data")
-    print("  Replication Strategy: SimpleStrategy")
-    print("  Replication Factor: 2")
+    print("  Replication Strategy: NetworkTopologyStrategy")
+    print("  Replication Factor: 2 in the local data center")
 
     print("\n🔧 If connection fails, check:")
     print("  1. Cassandra service is running")
@@ -5,13 +5,26 @@ import uuid
 import random
 import time
 import statistics
+from array import array
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, NamedTuple, Tuple
 import logging
 from dataclasses import dataclass, field
+from itertools import islice
 from concurrent.futures import ThreadPoolExecutor
 import threading
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,17 +32,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Read requests that stress test 2 picks from at random
+REQUEST_TYPES = (
+    'get_users', 'get_books', 'get_user_reservations',
+    'get_book_reservations', 'get_active_reservations'
+)
+
+def dump_json(obj) -> bytes:
+    """Encode a request body, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+def load_json(body: bytes):
+    """Decode a response body, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def percentile(sorted_times, percent: int) -> float:
+    """Read a percentile from already sorted times
+
+    Interpolates between the two nearest times, the same way
+    statistics.quantiles(method='inclusive') does.
+    """
+    position = (len(sorted_times) - 1) * percent
+    index, remainder = divmod(position, 100)
+    if remainder == 0:
+        return sorted_times[index]
+    return (
+        sorted_times[index] * (100 - remainder)
+        + sorted_times[index + 1] * remainder
+    ) / 100
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Connections the client opens, in total and to the one server under test
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 50
+
+# Every completion sends the same body, so it is encoded once
+COMPLETE_BODY = dump_json({"status": "completed"})
+
+# Distinct error messages kept as examples. Every error is still counted
+MAX_ERROR_SAMPLES = 50
+
+class Reservation(NamedTuple):
+    """The parts of a created reservation the tests use later"""
+    reservation_id: str
+    book_id: str
+
 @dataclass
 class TestResults:
     test_name: str
     total_requests: int = 0
     successful_requests: int = 0
     failed_requests: int = 0
-    response_times: List[float] = field(default_factory=list)
-    errors: List[str] = field(default_factory=list)
+    # Packed doubles rather than a list, so each time is 8 bytes instead of a
+    # separate float object
+    response_times: array = field(default_factory=lambda: array('d'))
+    error_counts: Counter = field(default_factory=Counter)
+    error_samples: List[str] = field(default_factory=list)
     start_time: float = 0
     end_time: float = 0
     
+    def add_error(self, error: str):
+        """Count an error, keeping the first few messages as samples"""
+        self.error_counts[error] += 1
+        if len(self.error_samples) < MAX_ERROR_SAMPLES:
+            self.error_samples.append(error)
+    
     @property
     def success_rate(self) -> float:
         if self.total_requests == 0:
@@ -40,7 +112,7 @@ class TestResults:
     def average_response_time(self) -> float:
         if not self.response_times:
             return 0.0
-        return statistics.mean(self.response_times)
+        return statistics.fmean(self.response_times)
     
     @property
     def total_duration(self) -> float:
@@ -58,12 +130,17 @@ class LibraryStressTest:
         self.session = None
         self.users = []
         self.books = []
+        # IDs of the users and books above, which is all most requests need
+        self.user_ids = []
+        self.book_ids = []
         self.reservations = []
         
     async def __aenter__(self):
-        connector = aiohttp.TCPConnector(limit=100, limit_per_host=50)
+        connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT, limit_per_host=CONNECTION_LIMIT_PER_HOST)
         timeout = aiohttp.ClientTimeout(total=30)
+        # Requests name only the endpoint, which the session joins onto base_url
         self.session = aiohttp.ClientSession(
+            base_url=self.base_url,
             connector=connector, 
             timeout=timeout
         )
@@ -73,92 +150,108 @@ class LibraryStressTest:
         if self.session:
             await self.session.close()
     
-    async def make_request(self, method: str, endpoint: str, data: Dict = None) -> Tuple[bool, float, Dict]:
-        """Make a single HTTP request and return success, response time, and response data"""
-        start_time = time.time()
+    @staticmethod
+    async def read_body(response: aiohttp.ClientResponse, parse_json: bool):
+        """Read a response, decoding it only if the caller needs the body"""
+        # The body has to be read either way for the connection to be reused
+        body = await response.read()
+        if parse_json:
+            return load_json(body)
+        return None
+    
+    async def make_request(self, method: str, endpoint: str, data: Dict = None, parse_json: bool = True, body: bytes = None) -> Tuple[bool, float, Dict]:
+        """Make a single HTTP request and return success, response time, and response data
+        
+        body is data already encoded as JSON, for payloads that are sent more
+        than once or built ahead of a timed section. With parse_json=False
+        the response data is None unless the request itself failed.
+        """
+        if body is None and data is not None:
+            body = dump_json(data)
+        headers = JSON_HEADERS if body is not None else None
+        start_time = time.perf_counter()
         try:
-            url = f"{self.base_url}{endpoint}"
-            
-            if method.upper() == 'GET':
-                async with self.session.get(url) as response:
-                    response_time = time.time() - start_time
-                    response_data = await response.json()
-                    return response.status < 400, response_time, response_data
-            
-            elif method.upper() == 'POST':
-                async with self.session.post(url, json=data) as response:
-                    response_time = time.time() - start_time
-                    response_data = await response.json()
-                    return response.status < 400, response_time, response_data
-            
-            elif method.upper() == 'PUT':
-                async with self.session.put(url, json=data) as response:
-                    response_time = time.time() - start_time
-                    response_data = await response.json()
-                    return response.status < 400, response_time, response_data
-            
-            elif method.upper() == 'DELETE':
-                async with self.session.delete(url, json=data) as response:
-                    response_time = time.time() - start_time
-                    response_data = await response.json()
-                    return response.status < 400, response_time, response_data
-                    
+            async with self.session.request(method, endpoint, data=body, headers=headers) as response:
+                response_time = time.perf_counter() - start_time
+                response_data = await self.read_body(response, parse_json)
+                return response.status < 400, response_time, response_data
         except Exception as e:
-            response_time = time.time() - start_time
+            response_time = time.perf_counter() - start_time
             logger.error(f"Request failed: {str(e)}")
             return False, response_time, {"error": str(e)}
     
+    @staticmethod
+    async def run_bounded(coros, concurrency: int = CONNECTION_LIMIT_PER_HOST):
+        """Run coroutines with at most concurrency at once, yielding each task as it finishes
+        
+        coros is consumed lazily, so only the running coroutines exist at any
+        time. More than the connection limit would only wait for a connection.
+        """
+        coros = iter(coros)
+        pending = {asyncio.ensure_future(coro) for coro in islice(coros, concurrency)}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.update(asyncio.ensure_future(coro) for coro in islice(coros, len(done)))
+            for task in done:
+                yield task
+    
     async def setup_test_data(self, num_users: int = 100, num_books: int = 50):
         """Create initial test data - users and books"""
         logger.info(f"Setting up test data: {num_users} users, {num_books} books")
         
         # Create users
-        user_tasks = []
-        for i in range(num_users):
-            user_data = {"username": f"testuser_{i}_{uuid.uuid4().hex[:8]}"}
-            user_tasks.append(self.create_user(user_data))
-        
-        user_results = await asyncio.gather(*user_tasks, return_exceptions=True)
+        user_tasks = (
+            self.create_user({"username": f"testuser_{i}_{uuid.uuid4().hex[:8]}"})
+            for i in range(num_users)
+        )
         
-        for result in user_results:
-            if isinstance(result, Exception):
-                logger.error(f"Failed to create user: {result}")
-            elif result[0]:  # success
-                self.users.append(result[2])
+        # Handle each result as it arrives rather than holding them all
+        async for task in self.run_bounded(user_tasks):
+            try:
+                success, _, user = await task
+            except Exception as e:
+                logger.error(f"Failed to create user: {e}")
+                continue
+            if success:
+                self.users.append(user)
         
         # Create books
-        book_tasks = []
-        for i in range(num_books):
-            book_data = {"title": f"Test Book {i} - {uuid.uuid4().hex[:8]}"}
-            book_tasks.append(self.create_book(book_data))
-        
-        book_results = await asyncio.gather(*book_tasks, return_exceptions=True)
-        
-        for result in book_results:
-            if isinstance(result, Exception):
-                logger.error(f"Failed to create book: {result}")
-            elif result[0]:  # success
-                self.books.append(result[2])
+        book_tasks = (
+            self.create_book({"title": f"Test Book {i} - {uuid.uuid4().hex[:8]}"})
+            for i in range(num_books)
+        )
         
+        async for task in self.run_bounded(book_tasks):
+            try:
+                success, _, book = await task
+            except Exception as e:
+                logger.error(f"Failed to create book: {e}")
+                continue
+            if success:
+                self.books.append(book)
+        
+        self.user_ids = [user['user_id'] for user in self.users]
+        self.book_ids = [book['book_id'] for book in self.books]
         logger.info(f"Created {len(self.users)} users and {len(self.books)} books")
     
     async def create_books_for_test(self, num_books: int, test_name: str) -> List[Dict]:
         """Create a separate pool of books for a specific test"""
         logger.info(f"Creating {num_books} dedicated books for {test_name}")
         
-        book_tasks = []
-        for i in range(num_books):
-            book_data = {"title": f"{test_name} Book {i} - {uuid.uuid4().hex[:8]}"}
-            book_tasks.append(self.create_book(book_data))
-        
-        book_results = await asyncio.gather(*book_tasks, return_exceptions=True)
+        book_tasks = (
+            self.create_book({"title": f"{test_name} Book {i} - {uuid.uuid4().hex[:8]}"})
+            for i in range(num_books)
+        )
         
         test_books = []
-        for result in book_results:
-            if isinstance(result, Exception):
-                logger.error(f"Failed to create book for {test_name}: {result}")
-            elif result[0]:  # success
-                test_books.append(result[2])
+        async for task in self.run_bounded(book_tasks):
+            try:
+                success, _, book = await task
+            except Exception as e:
+                logger.error(f"Failed to create book for {test_name}: {e}")
+                continue
+            if success:
+                test_books.append(book)
         
         logger.info(f"Created {len(test_books)} books for {test_name}")
         return test_books
@@ -174,8 +267,7 @@ class LibraryStressTest:
         return await self.make_request('POST', '/api/reservations', reservation_data)
     
     async def complete_reservation(self, reservation_id: str) -> Tuple[bool, float, Dict]:
-        update_data = {"status": "completed"}
-        return await self.make_request('PUT', f'/api/reservations/{reservation_id}', update_data)
+        return await self.make_request('PUT', f'/api/reservations/{reservation_id}', body=COMPLETE_BODY)
     
     async def bulk_cancel_reservations(self, reservation_ids: List[str]) -> Tuple[bool, float, Dict]:
         cancel_data = {"reservation_ids": reservation_ids}
@@ -187,37 +279,36 @@ class LibraryStressTest:
         logger.info(f"Starting Stress Test 1: {num_requests} rapid identical requests")
         
         results = TestResults("Stress Test 1: Rapid Fire Same Request")
-        results.start_time = time.time()
+        results.start_time = time.perf_counter()
         
         if not self.users:
             logger.error("No users available for testing")
             return results
         
         # Use first user for all requests
-        user_id = self.users[0]['user_id']
+        user_id = self.user_ids[0]
         
         # Create tasks for getting user's active reservations (should be fast)
-        tasks = []
-        for _ in range(num_requests):
-            tasks.append(self.make_request('GET', f'/api/users/{user_id}/active-reservations'))
-        
-        # Execute all requests concurrently
-        request_results = await asyncio.gather(*tasks, return_exceptions=True)
+        endpoint = f'/api/users/{user_id}/active-reservations'
+        tasks = (self.make_request('GET', endpoint, parse_json=False) for _ in range(num_requests))
         
-        results.end_time = time.time()
-        
-        for result in request_results:
+        # Keep as many requests in flight as there are connections, counting
+        # each one as it finishes
+        async for task in self.run_bounded(tasks):
             results.total_requests += 1
-            if isinstance(result, Exception):
+            try:
+                success, response_time, _ = await task
+            except Exception as e:
                 results.failed_requests += 1
-                results.errors.append(str(result))
+                results.add_error(str(e))
+                continue
+            results.response_times.append(response_time)
+            if success:
+                results.successful_requests += 1
             else:
-                success, response_time, _ = result
-                results.response_times.append(response_time)
-                if success:
-                    results.successful_requests += 1
-                else:
-                    results.failed_requests += 1
+                results.failed_requests += 1
+        
+        results.end_time = time.perf_counter()
         
         return results
 
@@ -227,48 +318,60 @@ class LibraryStressTest:
         logger.info(f"Starting Stress Test 2: {num_clients} clients, {requests_per_client} requests each")
         
         results = TestResults("Stress Test 2: Random Requests from Multiple Clients")
-        results.start_time = time.time()
+        results.start_time = time.perf_counter()
+        
+        # Each request is handed a random user ID, book ID and availability
+        # filter, drawn up front by its worker, and uses whichever it needs
+        def get_users(user_id, book_id, available):
+            return self.make_request('GET', '/api/users', parse_json=False)
+        
+        def get_books(user_id, book_id, available):
+            endpoint = '/api/books?available=true' if available else '/api/books?available=false'
+            return self.make_request('GET', endpoint, parse_json=False)
+        
+        def get_user_reservations(user_id, book_id, available):
+            return self.make_request('GET', f'/api/reservations/user/{user_id}', parse_json=False)
+        
+        def get_book_reservations(user_id, book_id, available):
+            return self.make_request('GET', f'/api/reservations/book/{book_id}', parse_json=False)
+        
+        def get_active_reservations(user_id, book_id, available):
+            return self.make_request('GET', f'/api/users/{user_id}/active-reservations', parse_json=False)
+        
+        def get_all_books(user_id, book_id, available):
+            return self.make_request('GET', '/api/books', parse_json=False)
+        
+        # Requests that need users or books fall back to listing books
+        # when there are none
+        dispatch = {
+            'get_users': get_users,
+            'get_books': get_books,
+            'get_user_reservations': get_user_reservations if self.users else get_all_books,
+            'get_book_reservations': get_book_reservations if self.books else get_all_books,
+            'get_active_reservations': get_active_reservations if self.users else get_all_books,
+        }
         
         async def client_worker(client_id: int) -> List[Tuple[bool, float, Dict]]:
             """Each client makes random requests"""
             client_results = []
             
-            for _ in range(requests_per_client):
-                # Randomly choose request type
-                request_type = random.choice([
-                    'get_users', 'get_books', 'get_user_reservations', 
-                    'get_book_reservations', 'get_active_reservations'
-                ])
-                
+            # Each client has its own generator, seeded with its ID so runs
+            # are repeatable, and makes every random choice up front
+            rng = random.Random(client_id)
+            request_types = rng.choices(REQUEST_TYPES, k=requests_per_client)
+            user_ids = rng.choices(self.user_ids, k=requests_per_client) if self.user_ids else [None] * requests_per_client
+            book_ids = rng.choices(self.book_ids, k=requests_per_client) if self.book_ids else [None] * requests_per_client
+            available_flags = rng.getrandbits(requests_per_client)
+            # Small random delays between requests, from 1ms to 10ms
+            delays = [rng.random() * 0.009 + 0.001 for _ in range(requests_per_client)]
+            
+            for i, (request_type, user_id, book_id, delay) in enumerate(zip(request_types, user_ids, book_ids, delays)):
                 try:
-                    if request_type == 'get_users':
-                        result = await self.make_request('GET', '/api/users')
-                        
-                    elif request_type == 'get_books':
-                        available_filter = random.choice([True, False])
-                        endpoint = f'/api/books?available={str(available_filter).lower()}'
-                        result = await self.make_request('GET', endpoint)
-                        
-                    elif request_type == 'get_user_reservations' and self.users:
-                        user = random.choice(self.users)
-                        result = await self.make_request('GET', f'/api/reservations/user/{user["user_id"]}')
-                        
-                    elif request_type == 'get_book_reservations' and self.books:
-                        book = random.choice(self.books)
-                        result = await self.make_request('GET', f'/api/reservations/book/{book["book_id"]}')
-                        
-                    elif request_type == 'get_active_reservations' and self.users:
-                        user = random.choice(self.users)
-                        result = await self.make_request('GET', f'/api/users/{user["user_id"]}/active-reservations')
-                        
-                    else:
-                        # Fallback to get books
-                        result = await self.make_request('GET', '/api/books')
-                    
+                    available = (available_flags >> i) & 1
+                    result = await dispatch[request_type](user_id, book_id, available)
                     client_results.append(result)
                     
-                    # Small random delay between requests
-                    await asyncio.sleep(random.uniform(0.001, 0.01))
+                    await asyncio.sleep(delay)
                     
                 except Exception as e:
                     client_results.append((False, 0.0, {"error": str(e)}))
@@ -279,13 +382,13 @@ class LibraryStressTest:
         client_tasks = [client_worker(i) for i in range(num_clients)]
         all_client_results = await asyncio.gather(*client_tasks, return_exceptions=True)
         
-        results.end_time = time.time()
+        results.end_time = time.perf_counter()
         
         # Aggregate results
         for client_results in all_client_results:
             if isinstance(client_results, Exception):
                 results.failed_requests += requests_per_client
-                results.errors.append(str(client_results))
+                results.add_error(str(client_results))
                 results.total_requests += requests_per_client
             else:
                 for success, response_time, _ in client_results:
@@ -304,22 +407,25 @@ class LibraryStressTest:
         logger.info("Starting Stress Test 3: Book Reservation Race Condition")
         
         results = TestResults("Stress Test 3: Book Reservation Race")
-        results.start_time = time.time()
+        results.start_time = time.perf_counter()
         
         if len(self.users) < 2 or len(self.books) < 1:
             logger.error("Need at least 2 users and 1 book for this test")
             return results
         
-        client1_user = self.users[0]
-        client2_user = self.users[1]
+        client1_user_id = self.user_ids[0]
+        client2_user_id = self.user_ids[1]
         
-        async def reservation_client(user: Dict, client_name: str) -> List[Tuple[bool, float, Dict]]:
+        async def reservation_client(user_id: str, client_name: str) -> List[Tuple[bool, float, Dict]]:
             """Each client tries to reserve all books"""
             client_results = []
             
-            for book in self.books:
+            # Encode every request before the race starts
+            bodies = [dump_json({"user_id": user_id, "book_id": book_id}) for book_id in self.book_ids]
+            
+            for body in bodies:
                 try:
-                    result = await self.create_reservation(user['user_id'], book['book_id'])
+                    result = await self.make_request('POST', '/api/reservations', body=body)
                     client_results.append(result)
                     
                     # Very small delay to simulate real-world timing
@@ -331,34 +437,35 @@ class LibraryStressTest:
             return client_results
         
         # Run both clients simultaneously
-        client1_task = reservation_client(client1_user, "Client1")
-        client2_task = reservation_client(client2_user, "Client2")
+        client1_task = reservation_client(client1_user_id, "Client1")
+        client2_task = reservation_client(client2_user_id, "Client2")
         
         client1_results, client2_results = await asyncio.gather(
             client1_task, client2_task, return_exceptions=True
         )
         
-        results.end_time = time.time()
+        results.end_time = time.perf_counter()
         
         # Process results from both clients
         for client_results in [client1_results, client2_results]:
             if isinstance(client_results, Exception):
                 results.failed_requests += len(self.books)
-                results.errors.append(str(client_results))
+                results.add_error(str(client_results))
                 results.total_requests += len(self.books)
             else:
-                for success, response_time, response_data in client_results:
+                # Each client made one request per book, in order
+                for book_id, (success, response_time, response_data) in zip(self.book_ids, client_results):
                     results.total_requests += 1
                     results.response_times.append(response_time)
                     if success:
                         results.successful_requests += 1
                         # Store successful reservations
                         if 'reservation_id' in response_data:
-                            self.reservations.append(response_data)
+                            self.reservations.append(Reservation(response_data['reservation_id'], book_id))
                     else:
                         results.failed_requests += 1
                         if 'error' in response_data:
-                            results.errors.append(response_data['error'])
+                            results.add_error(response_data['error'])
         
         # Log fairness analysis
         client1_successes = sum(1 for success, _, _ in client1_results if success)
@@ -371,12 +478,13 @@ class LibraryStressTest:
         return results
 
     # STRESS TEST 4: Constant completions and reservations (FIXED)
-    async def stress_test_4_constant_activity(self, duration_seconds: int = 60) -> TestResults:
-        """Constant stream of reservations and completions"""
-        logger.info(f"Starting Stress Test 4: Constant activity for {duration_seconds} seconds")
+    async def stress_test_4_constant_activity(self, duration_seconds: int = 60, reservation_workers: int = 8, completion_workers: int = 8) -> TestResults:
+        """Constant stream of reservations and completions from several workers of each kind"""
+        logger.info(f"Starting Stress Test 4: Constant activity for {duration_seconds} seconds "
+                    f"with {reservation_workers} reservation and {completion_workers} completion workers")
         
         results = TestResults("Stress Test 4: Constant Reservations and Completions")
-        results.start_time = time.time()
+        results.start_time = time.perf_counter()
         
         if len(self.users) < 5:
             logger.error("Need at least 5 users for this test")
@@ -389,35 +497,31 @@ class LibraryStressTest:
             logger.error("Failed to create enough books for Test 4")
             return results
         
-        end_time = time.time() + duration_seconds
-        active_reservations = []
+        end_time = time.perf_counter() + duration_seconds
+        # Reservations waiting to be completed, handed from the reservation
+        # workers to the completion workers
+        active_reservations = asyncio.Queue()
 
-        available_books = set(book['book_id'] for book in test4_books)
-        reserved_books = set()
-        
-        # Lock for thread-safe access to shared data structures
-        lock = asyncio.Lock()
+        # Books not held by any reservation. The workers share one event
+        # loop, and nothing awaits between checking and updating these, so
+        # no lock is needed
+        free_books = {book['book_id'] for book in test4_books}
         
         async def reservation_worker():
             """Continuously make new reservations"""
-            nonlocal active_reservations, reserved_books, available_books
-            
-            while time.time() < end_time:
+            while time.perf_counter() < end_time:
+                book_id = None
                 try:
-                    async with lock:
-                        available_unreserved = available_books - reserved_books
-                        if not available_unreserved:
-                            # No books available, wait and continue
-                            await asyncio.sleep(0.1)
-                            continue
-                        
-                        book_id = random.choice(list(available_unreserved))
-                        reserved_books.add(book_id)
+                    if not free_books:
+                        # No books available, wait and continue
+                        await asyncio.sleep(0.1)
+                        continue
                     
-                    user = random.choice(self.users)
+                    book_id = free_books.pop()
+                    user_id = self.user_ids[random.randrange(len(self.user_ids))]
                     
                     success, response_time, response_data = await self.create_reservation(
-                        user['user_id'], book_id
+                        user_id, book_id
                     )
                     
                     results.total_requests += 1
@@ -425,84 +529,70 @@ class LibraryStressTest:
 
                     if success and 'reservation_id' in response_data:
                         results.successful_requests += 1
-                        async with lock:
-                            # Store both reservation data and the book_id for later cleanup
-                            reservation_data = response_data.copy()
-                            reservation_data['book_id'] = book_id
-                            active_reservations.append(reservation_data)
+                        # Store the reservation and its book for later cleanup
+                        active_reservations.put_nowait(Reservation(response_data['reservation_id'], book_id))
                     else:
                         results.failed_requests += 1
                         if 'error' in response_data:
-                            results.errors.append(response_data['error'])
+                            results.add_error(response_data['error'])
                         
                         # If reservation failed, free up the book
-                        async with lock:
-                            reserved_books.discard(book_id)
+                        free_books.add(book_id)
                     
                     await asyncio.sleep(random.uniform(0.1, 0.5))
                     
                 except Exception as e:
                     results.failed_requests += 1
-                    results.errors.append(str(e))
+                    results.add_error(str(e))
                     # Make sure to free up the book if there was an error
-                    if 'book_id' in locals():
-                        async with lock:
-                            reserved_books.discard(book_id)
-
-            print("Reservation worker finished")
+                    if book_id is not None:
+                        free_books.add(book_id)
         
         async def completion_worker():
             """Continuously complete reservations"""
-            nonlocal active_reservations, reserved_books
-            
-            while time.time() < end_time:
+            while True:
+                remaining = end_time - time.perf_counter()
+                if remaining <= 0:
+                    break
                 try:
-                    reservation = None
-                    async with lock:
-                        if active_reservations:
-                            reservation = active_reservations.pop(0)
+                    # Wait for a reservation rather than polling, giving up
+                    # when the test ends
+                    reservation = await asyncio.wait_for(active_reservations.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                
+                try:
+                    success, response_time, response_data = await self.complete_reservation(
+                        reservation.reservation_id
+                    )
                     
-                    if reservation:
-                        success, response_time, response_data = await self.complete_reservation(
-                            reservation['reservation_id']
-                        )
-                        
-                        results.total_requests += 1
-                        results.response_times.append(response_time)
-                        
-                        if success:
-                            results.successful_requests += 1
-                            # Free up the book when reservation is completed
-                            async with lock:
-                                reserved_books.discard(reservation['book_id'])
-                        else:
-                            results.failed_requests += 1
-                            if 'error' in response_data:
-                                results.errors.append(response_data['error'])
-                            # If completion failed, put the reservation back and keep book reserved
-                            async with lock:
-                                active_reservations.append(reservation)
+                    results.total_requests += 1
+                    results.response_times.append(response_time)
+                    
+                    if success:
+                        results.successful_requests += 1
+                        # Free up the book when reservation is completed
+                        free_books.add(reservation.book_id)
                     else:
-                        # No reservations to complete, wait a bit
-                        await asyncio.sleep(0.1)
+                        results.failed_requests += 1
+                        if 'error' in response_data:
+                            results.add_error(response_data['error'])
+                        # If completion failed, put the reservation back and keep book reserved
+                        active_reservations.put_nowait(reservation)
                     
                     await asyncio.sleep(random.uniform(0.2, 0.8))
                     
                 except Exception as e:
                     results.failed_requests += 1
-                    results.errors.append(str(e))
-
-            print("Completion worker finished")
+                    results.add_error(str(e))
         
-        # Run both workers concurrently
-        await asyncio.gather(
-            reservation_worker(),
-            completion_worker(),
-            return_exceptions=True
-        )
+        # Run all workers concurrently
+        workers = [reservation_worker() for _ in range(reservation_workers)]
+        workers += [completion_worker() for _ in range(completion_workers)]
+        await asyncio.gather(*workers, return_exceptions=True)
         
-        results.end_time = time.time()
-        logger.info(f"Test 4 completed with {len(active_reservations)} active reservations remaining")
+        results.end_time = time.perf_counter()
+        logger.info(f"Test 4 completed with {active_reservations.qsize()} active reservations remaining")
 
         return results
 
@@ -512,7 +602,7 @@ class LibraryStressTest:
         logger.info(f"Starting Stress Test 5: Bulk cancellation of {num_reservations} reservations")
         
         results = TestResults("Stress Test 5: Large Group Cancellation")
-        results.start_time = time.time()
+        results.start_time = time.perf_counter()
         
         # Create dedicated books for this test (ensure we have enough available books)
         books_needed = min(num_reservations, 80)  # Limit to reasonable number
@@ -526,31 +616,39 @@ class LibraryStressTest:
         reservation_tasks = []
         created_reservations = []
         
-        used_books = set()
+        # Each book is reserved at most once, so draw them from a shuffled copy
+        # instead of filtering out the used ones on every iteration
+        available = [book['book_id'] for book in test5_books]
+        random.shuffle(available)
+        book_iter = iter(available)
+        user_ids = self.user_ids
         for i in range(num_reservations):
-            if self.users and test5_books:
-                user = random.choice(self.users)
-                book = random.choice([b for b in test5_books if b['book_id'] not in used_books])
-                used_books.add(book['book_id'])
-                reservation_tasks.append(self.create_reservation(user['user_id'], book['book_id']))
+            if not user_ids:
+                break
+            book_id = next(book_iter, None)
+            if book_id is None:
+                break
+            user_id = user_ids[random.randrange(len(user_ids))]
+            reservation_tasks.append(self.create_reservation(user_id, book_id))
         
         # Create reservations
         logger.info(f"Creating {len(reservation_tasks)} reservations...")
-        reservation_results = await asyncio.gather(*reservation_tasks, return_exceptions=True)
-        
-        for result in reservation_results:
+        for task in asyncio.as_completed(reservation_tasks):
             results.total_requests += 1
-            if isinstance(result, Exception):
+            try:
+                success, response_time, response_data = await task
+            except Exception as e:
                 results.failed_requests += 1
-                results.errors.append(str(result))
+                results.add_error(str(e))
+                continue
+            results.response_times.append(response_time)
+            # Only the ID is kept, so the response can be freed straight away
+            reservation_id = response_data.get('reservation_id') if success else None
+            if reservation_id:
+                results.successful_requests += 1
+                created_reservations.append(reservation_id)
             else:
-                success, response_time, response_data = result
-                results.response_times.append(response_time)
-                if success and 'reservation_id' in response_data:
-                    results.successful_requests += 1
-                    created_reservations.append(response_data['reservation_id'])
-                else:
-                    results.failed_requests += 1
+                results.failed_requests += 1
         
         logger.info(f"Created {len(created_reservations)} reservations successfully")
         
@@ -565,24 +663,23 @@ class LibraryStressTest:
         
         # Execute bulk cancellations
         logger.info(f"Performing {len(cancellation_tasks)} bulk cancellation operations...")
-        cancellation_results = await asyncio.gather(*cancellation_tasks, return_exceptions=True)
-        
-        for result in cancellation_results:
+        for task in asyncio.as_completed(cancellation_tasks):
             results.total_requests += 1
-            if isinstance(result, Exception):
+            try:
+                success, response_time, response_data = await task
+            except Exception as e:
                 results.failed_requests += 1
-                results.errors.append(str(result))
+                results.add_error(str(e))
+                continue
+            results.response_times.append(response_time)
+            if success:
+                results.successful_requests += 1
             else:
-                success, response_time, response_data = result
-                results.response_times.append(response_time)
-                if success:
-                    results.successful_requests += 1
-                else:
-                    results.failed_requests += 1
-                    if 'error' in response_data:
-                        results.errors.append(response_data['error'])
+                results.failed_requests += 1
+                if 'error' in response_data:
+                    results.add_error(response_data['error'])
         
-        results.end_time = time.time()
+        results.end_time = time.perf_counter()
         return results
 
     def print_results(self, results: TestResults):
@@ -598,25 +695,21 @@ class LibraryStressTest:
         print(f"🚀 Requests/Second: {results.requests_per_second:.2f}")
         
         if results.response_times:
+            # Sort once and read every order statistic from the sorted times
+            times = sorted(results.response_times)
+            median = percentile(times, 50)
+            p95 = percentile(times, 95)
+            p99 = percentile(times, 99)
             print(f"📊 Average Response Time: {results.average_response_time:.4f} seconds")
-            print(f"📊 Min Response Time: {min(results.response_times):.4f} seconds")
-            print(f"📊 Max Response Time: {max(results.response_times):.4f} seconds")
-            print(f"📊 Median Response Time: {statistics.median(results.response_times):.4f} seconds")
+            print(f"📊 Min Response Time: {times[0]:.4f} seconds")
+            print(f"📊 Max Response Time: {times[-1]:.4f} seconds")
+            print(f"📊 Median Response Time: {median:.4f} seconds")
+            print(f"📊 95th Percentile Response Time: {p95:.4f} seconds")
+            print(f"📊 99th Percentile Response Time: {p99:.4f} seconds")
         
-        if results.errors:
+        if results.error_counts:
             print(f"\n❌ Top Errors:")
-            error_counts = {}
-            for error in results.errors[:20]:  # Show top 20 errors
-                error_counts[error] = error_counts.get(error, 0) + 1
-            
-            for error, count in sorted(error_counts.items(), key=lambda x: x[1], reverse=True)[:5]:
-                print(f"   {count}x: {error}")
-
-        # NOTE PRINT ALL ERRORS FOR DEBUGGING DELETE LATER
-            for error in results.errors:
-                error_counts[error] = error_counts.get(error, 0) + 1
-
-            for error, count in sorted(error_counts.items(), key=lambda x: x[1], reverse=True)[:5]:
+            for error, count in results.error_counts.most_common(5):
                 print(f"   {count}x: {error}")
         
         print(f"{'='*60}\n")
@@ -696,6 +789,10 @@ if __name__ == "__main__":
     print("=" * 60)
     
     try:
+        if uvloop is not None:
+            # libuv-based loop, so the client is less likely to be the
+            # bottleneck. It is optional, as it is not available on Windows
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         asyncio.run(main())
     except KeyboardInterrupt:
         print("\n⚡ Tests interrupted by user")
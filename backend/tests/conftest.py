@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app imports its modules relative to backend/app, as main.py is run
+# from there
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "app")
+)
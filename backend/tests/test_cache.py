@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+import cache
+from cache import TTLCache
+
+
+class Clock:
+    """Stand-in for time.monotonic() that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_concurrent_gets_share_one_load():
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0)
+        return "value"
+
+    async def main():
+        ttl_cache = TTLCache(ttl=10, maxsize=4)
+        results = await asyncio.gather(
+            *(ttl_cache.get("key", load) for _ in range(5))
+        )
+        assert results == ["value"] * 5
+        assert await ttl_cache.get("key", load) == "value"
+
+    asyncio.run(main())
+    assert calls == 1
+
+
+def test_invalidate_during_load_does_not_cache_result():
+    async def main():
+        ttl_cache = TTLCache(ttl=10, maxsize=4)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def load():
+            started.set()
+            await release.wait()
+            return "stale"
+
+        task = asyncio.ensure_future(ttl_cache.get("key", load))
+        await started.wait()
+        ttl_cache.invalidate("key")
+        release.set()
+
+        # The caller that started the load still gets its result
+        assert await task == "stale"
+        assert ttl_cache.peek("key") is None
+
+    asyncio.run(main())
+
+
+def test_failed_load_is_not_cached():
+    async def main():
+        ttl_cache = TTLCache(ttl=10, maxsize=4)
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            await ttl_cache.get("key", fail)
+        assert ttl_cache.peek("key") is None
+        assert "key" not in ttl_cache.loading
+
+        async def load():
+            return "value"
+
+        assert await ttl_cache.get("key", load) == "value"
+
+    asyncio.run(main())
+
+
+def test_none_is_not_cached():
+    async def main():
+        ttl_cache = TTLCache(ttl=10, maxsize=4)
+
+        async def load():
+            return None
+
+        assert await ttl_cache.get("key", load) is None
+        assert "key" not in ttl_cache.entries
+
+    asyncio.run(main())
+
+
+def test_entries_expire_after_ttl(clock):
+    ttl_cache = TTLCache(ttl=2, maxsize=4)
+    token = ttl_cache.reserve("key")
+    ttl_cache.put("key", token, "value")
+
+    clock.now += 1.9
+    assert ttl_cache.peek("key") == "value"
+    clock.now += 0.2
+    assert ttl_cache.peek("key") is None
+    assert "key" not in ttl_cache.entries
+
+
+def test_put_after_invalidate_is_dropped():
+    ttl_cache = TTLCache(ttl=10, maxsize=4)
+    token = ttl_cache.reserve("key")
+    ttl_cache.invalidate("key")
+    ttl_cache.put("key", token, "stale")
+    assert ttl_cache.peek("key") is None
+
+
+def test_oldest_entry_is_evicted_when_full():
+    ttl_cache = TTLCache(ttl=10, maxsize=2)
+    for key in ("a", "b", "c"):
+        ttl_cache.put(key, ttl_cache.reserve(key), key)
+    assert list(ttl_cache.entries) == ["b", "c"]
+
+
+def test_restoring_a_cached_key_evicts_nothing():
+    ttl_cache = TTLCache(ttl=10, maxsize=2)
+    for key in ("a", "b", "b"):
+        ttl_cache.put(key, ttl_cache.reserve(key), key)
+    assert ttl_cache.peek("a") == "a"
+    assert ttl_cache.peek("b") == "b"
+
+
+def test_discard_releases_only_its_own_reservation():
+    ttl_cache = TTLCache(ttl=10, maxsize=4)
+    stale = ttl_cache.reserve("key")
+    token = ttl_cache.reserve("key")
+    ttl_cache.discard("key", stale)
+    assert ttl_cache.building["key"] is token
+    ttl_cache.discard("key", token)
+    assert "key" not in ttl_cache.building
@@ -0,0 +1,179 @@
+import asyncio
+from collections import namedtuple
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+import consistency_checker
+from consistency_checker import DataConsistencyChecker
+
+# One row type with every column the scans read. Columns a scan does not
+# select are left as None
+Row = namedtuple("Row", (
+    "user_id", "book_id", "reservation_id", "reservation_date", "status",
+    "title", "created_at", "active_count"
+), defaults=(None,) * 8)
+
+CREATED_AT = datetime(2025, 1, 1)
+
+
+class Result:
+    """Stand-in for a conditional statement's ResultSet"""
+
+    def __init__(self, was_applied):
+        self.was_applied = was_applied
+
+
+class Batch:
+    """Stand-in for BatchStatement that only records what is added"""
+
+    def __init__(self, **kwargs):
+        self.statements = []
+
+    def add(self, statement, parameters):
+        self.statements.append((statement, parameters))
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    """Rows returned by each scan, keyed by its query, two per page"""
+    tables = {}
+
+    async def execute_paged(query, parameters=None, fetch_size=None):
+        rows = tables.get(query, [])
+        for start in range(0, max(len(rows), 1), 2):
+            yield rows[start:start + 2], start + 2 < len(rows)
+
+    monkeypatch.setattr(consistency_checker, "get_prepared", lambda q: q)
+    monkeypatch.setattr(consistency_checker, "execute_paged", execute_paged)
+    return tables
+
+
+def load(tables):
+    return asyncio.run(DataConsistencyChecker()._load_all_data())
+
+
+def active(user_id, book_id, reservation_id=None):
+    return Row(
+        user_id=user_id, book_id=book_id,
+        reservation_id=reservation_id or uuid4(),
+        reservation_date=CREATED_AT
+    )
+
+
+def book(book_id, status, title="Title"):
+    return Row(
+        book_id=book_id, title=title, status=status, created_at=CREATED_AT
+    )
+
+
+def test_active_count_fixes_hold_how_far_each_counter_is_below(tables):
+    behind, ahead, correct, idle = (uuid4() for _ in range(4))
+    tables[consistency_checker.SCAN_ACTIVE_RESERVATIONS] = [
+        active(behind, uuid4()),
+        active(behind, uuid4()),
+        active(ahead, uuid4()),
+        active(correct, uuid4()),
+    ]
+    tables[consistency_checker.SCAN_USER_COUNTERS] = [
+        Row(user_id=behind, active_count=1),
+        Row(user_id=ahead, active_count=3),
+        Row(user_id=correct, active_count=1),
+        Row(user_id=idle, active_count=0),
+    ]
+
+    data = load(tables)
+
+    assert data['active_count_fixes'] == {behind: 1, ahead: -2}
+
+
+def test_books_are_listed_under_the_status_they_end_up_with(tables):
+    reserved, free, renamed, listed = (uuid4() for _ in range(4))
+    tables[consistency_checker.SCAN_ACTIVE_RESERVATIONS] = [
+        active(uuid4(), reserved)
+    ]
+    tables[consistency_checker.SCAN_BOOKS] = [
+        book(reserved, "available"),
+        book(free, "available"),
+        book(renamed, "available", "New title"),
+        book(listed, "available"),
+    ]
+    tables[consistency_checker.SCAN_BOOKS_BY_STATUS] = [
+        Row(status="available", book_id=reserved, title="Title"),
+        Row(status="available", book_id=renamed, title="Old title"),
+        Row(status="available", book_id=listed, title="Title"),
+        Row(status="checked_out", book_id=free, title="Title"),
+    ]
+
+    data = load(tables)
+
+    assert sorted(data['book_listing_fixes']) == sorted([
+        ("checked_out", reserved, "Title", CREATED_AT),
+        ("available", free, "Title", CREATED_AT),
+        ("available", renamed, "New title", CREATED_AT),
+    ])
+    assert sorted(data['stray_book_listings']) == sorted([
+        ("available", reserved),
+        ("checked_out", free),
+    ])
+    assert data['book_status_fixes'] == [
+        (reserved, "Title", "available", "checked_out")
+    ]
+
+
+def test_denormalized_statuses_are_checked_row_by_row(tables):
+    user_id, book_id = uuid4(), uuid4()
+    held = active(user_id, book_id)
+    returned = uuid4()
+    tables[consistency_checker.SCAN_ACTIVE_RESERVATIONS] = [held]
+    # The main table agrees with the active reservations
+    tables[consistency_checker.SCAN_RESERVATIONS] = [
+        Row(reservation_id=held.reservation_id, status="active"),
+        Row(reservation_id=returned, status="completed"),
+    ]
+    tables[consistency_checker.SCAN_BY_USER] = [
+        Row(user_id=user_id, reservation_id=held.reservation_id,
+            status="completed"),
+        Row(user_id=user_id, reservation_id=returned, status="completed"),
+    ]
+    tables[consistency_checker.SCAN_BY_BOOK] = [
+        Row(book_id=book_id, reservation_id=held.reservation_id,
+            status="active"),
+        Row(book_id=book_id, reservation_id=returned, status="active"),
+    ]
+
+    data = load(tables)
+
+    assert data['reservation_status_fixes'] == []
+    assert data['by_user_status_fixes'] == [
+        (user_id, held.reservation_id, "completed", "active")
+    ]
+    assert data['by_book_status_fixes'] == [
+        (book_id, returned, "active", "completed")
+    ]
+
+
+@pytest.mark.parametrize("was_applied", [True, False])
+def test_cancelled_duplicate_counts_only_if_its_delete_applied(
+    monkeypatch, was_applied
+):
+    deletes = []
+
+    async def execute_async(statement, parameters=None):
+        if statement == consistency_checker.DELETE_ACTIVE:
+            deletes.append(parameters)
+            return Result(was_applied)
+        return Result(True)
+
+    monkeypatch.setattr(consistency_checker, "get_prepared", lambda q: q)
+    monkeypatch.setattr(consistency_checker, "execute_async", execute_async)
+    monkeypatch.setattr(consistency_checker, "BatchStatement", Batch)
+
+    user_id, book_id = uuid4(), uuid4()
+    result = asyncio.run(DataConsistencyChecker()._cancel_reservation(
+        uuid4(), user_id, book_id, CREATED_AT
+    ))
+
+    assert deletes == [(user_id, book_id)]
+    assert result == (user_id if was_applied else None)
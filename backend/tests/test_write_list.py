@@ -0,0 +1,103 @@
+import json
+
+import pytest
+import tornado.web
+from tornado.simple_httpclient import HTTPStreamClosedError
+from tornado.testing import AsyncHTTPTestCase
+
+from cache import TTLCache
+from handlers import base_handler
+from handlers.base_handler import BaseHandler
+
+
+def pages_of(*pages, error=None):
+    """Page iterator yielding each list of rows, then raising error if set"""
+    async def pages_iter():
+        for index, rows in enumerate(pages):
+            yield rows, index + 1 < len(pages) or error is not None
+        if error is not None:
+            raise error
+    return pages_iter
+
+
+class ListHandler(BaseHandler):
+    async def get(self):
+        settings = self.application.settings
+        settings["calls"].append(1)
+        try:
+            await self.write_list(
+                {"filter": "none"}, "items", settings["pages"](),
+                lambda row: {"id": row}, "total_count",
+                settings["cache"], "items"
+            )
+        except RuntimeError:
+            self.set_status(500)
+            self.write({"error": "failed"})
+
+
+class WriteListTest(AsyncHTTPTestCase):
+    pages = staticmethod(pages_of([]))
+
+    def get_app(self):
+        self.cache = TTLCache(ttl=60, maxsize=4)
+        self.calls = []
+        return tornado.web.Application(
+            [(r"/items", ListHandler)],
+            pages=lambda: self.pages(),
+            cache=self.cache,
+            calls=self.calls
+        )
+
+    def get_items(self):
+        return self.fetch("/items", raise_error=False)
+
+    def test_empty_list(self):
+        response = self.get_items()
+        assert response.code == 200
+        assert json.loads(response.body) == {
+            "filter": "none", "items": [], "total_count": 0
+        }
+
+    def test_pages_are_joined_and_cached(self):
+        self.pages = pages_of([1, 2], [], [3])
+        response = self.get_items()
+        expected = {
+            "filter": "none",
+            "items": [{"id": 1}, {"id": 2}, {"id": 3}],
+            "total_count": 3
+        }
+        assert json.loads(response.body) == expected
+        assert json.loads(self.cache.peek("items")) == expected
+
+        # Served from the cache without reading any pages
+        self.pages = pages_of(error=RuntimeError("not read"))
+        assert json.loads(self.get_items().body) == expected
+        assert len(self.calls) == 2
+
+    def test_list_over_the_cache_limit_is_not_cached(self):
+        self.pages = pages_of([1, 2], [3, 4])
+        original = base_handler.MAX_CACHED_LIST_SIZE
+        base_handler.MAX_CACHED_LIST_SIZE = 40
+        try:
+            response = self.get_items()
+        finally:
+            base_handler.MAX_CACHED_LIST_SIZE = original
+        assert json.loads(response.body)["total_count"] == 4
+        assert self.cache.peek("items") is None
+        assert "items" not in self.cache.building
+
+    def test_error_before_flush_can_still_be_answered(self):
+        self.pages = pages_of(error=RuntimeError("first page"))
+        response = self.get_items()
+        assert response.code == 500
+        assert json.loads(response.body) == {"error": "failed"}
+        assert "items" not in self.cache.building
+
+    def test_error_after_flush_closes_the_connection(self):
+        self.pages = pages_of([1], error=RuntimeError("second page"))
+        # The 200 status was already sent, so the client only sees the
+        # response cut short
+        with pytest.raises(HTTPStreamClosedError):
+            self.get_items()
+        assert self.cache.peek("items") is None
+        assert "items" not in self.cache.building